@@ -1,9 +1,14 @@
 import client
+import instrument
 import random
 import minesweep
+import solver
+import collections
+import concurrent.futures
 import itertools
+import math
 import time
-import os, sys
+import sys
 
 DIJ = list(itertools.product((-1, 0, 1), (-1, 0, 1)))
 DIJ.remove((0, 0))
@@ -11,22 +16,53 @@ DIJ.remove((0, 0))
 WATCH = 1
 WATCH_DELAY = 0.1
 DEBUG = 0
+# fewest candidate slots worth sending to the process pool
+PARALLEL_MIN_SLOTS = 32
+# components up to this many slots are solved once, through the cache
+CACHE_MAX_SLOTS = 20
+# the solver phases get_input runs in this order, until one finds a safe slot
+PHASES = ('infer', 'search_safe_slot', 'advanced_infer', 'search_safe_slot', 'endgame')
+# endgame() only runs when at most this many mines are left
+ENDGAME_MINES = 20
+# keep the record of one move out of that many, 0 for none
+RECORD_EVERY = 1
+# the search budget of a move, in seconds and search nodes (None for no
+#  limit). When it runs out the move is the best guess found so far
+MOVE_SECONDS = 5
+MOVE_NODES = None
+# searchField is compacted when it has doubled since the last time, and
+#  not below this size
+COMPACT_MIN = 4096
+# random positions tried to find an interior slot before scanning the field
+INTERIOR_TRIES = 1024
+# the search budget of a move of NoGuessProbe, in search nodes: a board is
+#  no-guess or not the same way however busy the machine is
+NO_GUESS_NODES = 100000
 
-def get_neigs(pos, field):
-    i, j = pos
-    return [(i+di, j+dj) for di, dj in DIJ if (i+di, j+dj) in field]
+# solved components shared by every client of the process
+componentCache = solver.ComponentCache()
 
-class Timer:
-    def __init__(self):
-        self.lastTime = time.clock()
+def get_neigs(pos, in_field):
+    i, j = pos
+    return [(i+di, j+dj) for di, dj in DIJ if in_field((i+di, j+dj))]
 
-    def tick(self):
-        curTime = time.clock()
-        deltaTime = curTime - self.lastTime
-        self.lastTime = curTime
-        return int(deltaTime * 1000)
+def by_pos(item):
+    """
+    The sort key of slots and nodes. Where the order of a set of them
+    decides a move, they are taken by position, so the moves of a client
+    only depend on what it saw (see gamelog.py).
+    """
+    return item.pos
 
-gTimer = Timer()
+def convolve(a, b):
+    """
+    Multiply two polynomials given as dicts of power to coefficient.
+    """
+    c = {}
+    for i, x in a.items():
+        for j, y in b.items():
+            c[i + j] = c.get(i + j, 0) + x * y
+    return c
 
 class Node:
     """
@@ -37,9 +73,6 @@ class Node:
     count: how many mines are contained in the rest slots
     restSlots
     """
-    # choice count cache
-    _cccache = {}
-
     def __init__(self, pos, count):
         self.pos = pos
         self.count = count
@@ -52,30 +85,24 @@ class Node:
     def get_choice_count(self):
         n = len(self.restSlots)
         k = self.count
-        key = n, k
-        value = self._cccache.get(key, None)
-        if value is not None:
-            return value
-        value = sum(1 for t in itertools.product(*((0, 1) for i in range(n))) if sum(t) == k)
-        self._cccache[key] = value
-        return value
+        if k < 0 or k > n:
+            return 0
+        return math.comb(n, k)
 
     def get_choices(self):
-        slots = list(self.restSlots)
-        candidates = []
-        for dist in itertools.product(*((0, 1) for i in range(len(slots)))):
-            if sum(dist) != self.count: continue
-            conflictCount = 0
-            if DEBUG: print('<get_choices>')
-            for slot, val in zip(slots, dist):
-                conflictCount += slot.apply(val)
-            for slot in reversed(slots):
-                slot.undo()
-            if DEBUG: print('</get_choices>')
-            candidates.append((conflictCount, list(zip(slots, dist))))
-        candidates.sort(key=lambda x:x[0])
-        for conflictCount, item in candidates:
-            yield item
+        """
+        Yield the ways to place count mines in the rest slots, as lists of
+        (slot, val). Mines go to the slots shared with fewest other nodes
+        first, since they constrain the rest of the field the least.
+        """
+        slots = sorted(self.restSlots, key=lambda slot: (len(slot.nodes), slot.pos))
+        if self.count < 0 or self.count > len(slots):
+            return
+        for picked in itertools.combinations(range(len(slots)), self.count):
+            dist = [0] * len(slots)
+            for i in picked:
+                dist[i] = 1
+            yield list(zip(slots, dist))
 
     def __hash__(self):
         return hash(self.pos)
@@ -105,6 +132,7 @@ class Slot:
         """
         assert self.val is None
         self.val = val
+        if instrument.ENABLED: instrument.counters['apply'] += 1
         if DEBUG: print('<apply {}, slot={}>'.format(self.pos, self)) 
         for node in self.nodes:
             if DEBUG: print('<remove {} node={}>'.format(node.pos, node))
@@ -124,6 +152,7 @@ class Slot:
 
     def undo(self):
         if DEBUG: print('<undo {} slot={}>'.format(self.pos, self))
+        if instrument.ENABLED: instrument.counters['undo'] += 1
         for node in self.nodes:
             node.restSlots.add(self)
             if self.val == 1:
@@ -134,10 +163,134 @@ class Slot:
     def __hash__(self):
         return hash(self.pos)
 
+# what searchField holds for an uncovered position whose node was dropped
+RESOLVED = Node(None, 0)
+
+class ComponentRecord:
+    """
+    What the solver found out about a frontier component. It is kept from
+    move to move as long as the constraints of the component do not change,
+    see AIClient.record_of.
+    members:
+
+    size: how many slots the component has.
+    maxMines: the mine limit the record holds for, None for no limit.
+    cannot: cannot[val] is the mask of the bits no solution gives val.
+    able: able[val] is a dict of bit index to the fewest mines of a
+        witness, that is a solution found so far, with val at that bit.
+    forced: (safes, mines) from ComponentCache.forced under maxMines, None
+        until counted.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.maxMines = None
+        self.cannot = [0, 0]
+        self.able = [{}, {}]
+        self.forced = None
+
+    def limit(self, maxMines):
+        """
+        Move the record to another mine limit. Under a lower one what can
+        not be still can not, and the solutions with too many mines are
+        dropped; under a higher one the solutions still hold but the rest
+        must be proved again.
+        """
+        if maxMines == self.maxMines:
+            return
+        if maxMines is None or self.maxMines is not None and maxMines > self.maxMines:
+            self.cannot = [0, 0]
+        else:
+            self.able = [{i: m for i, m in able.items() if m <= maxMines} for able in self.able]
+        self.maxMines = maxMines
+        self.forced = None
+
+    def answer(self, i, val):
+        """
+        True if some solution gives val to bit i, False if none does, None
+        if it is not known yet.
+        """
+        if self.cannot[val] >> i & 1:
+            return False
+        if i in self.able[val]:
+            return True
+        return None
+
+    def found(self, val, bit, solution):
+        """
+        Keep the answer of a search for a solution giving val to bit. A
+        solution found is kept as a witness for all its bits, so the
+        searches for the values it gives them are not needed any more.
+        """
+        if solution is None:
+            self.cannot[val] |= bit
+            return
+        mines = solver.popcount(solution)
+        for i in range(self.size):
+            able = self.able[solution >> i & 1]
+            if mines < able.get(i, mines + 1):
+                able[i] = mines
+
+class SearchField(dict):
+    """
+    The dict of position to Slot or Node of an AIClient, holding only the
+    touched part of the field. An unknown position gets its Slot on first
+    access. AIClient.compact() drops the nodes and mines that can no longer
+    take part in a deduction: a dropped node reads back as RESOLVED and a
+    dropped mine as a new Slot with val 1, from what the client sees there.
+    """
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+
+    def __missing__(self, pos):
+        client = self.client
+        if not client.in_field(pos):
+            raise KeyError(pos)
+        seen = client.field.get(pos, client.FLD_UNKNOWN)
+        if seen == client.FLD_UNKNOWN:
+            slot = Slot(pos, [])
+        elif seen == client.FLD_MARK:
+            slot = Slot(pos, [])
+            slot.val = 1
+        else:
+            return RESOLVED
+        self[pos] = slot
+        return slot
+
 class AIClient(client.Client):
-    def __init__(self, game):
+    """
+    members:
+
+    workers: if not 0, the per-slot trials of search_safe_slot and
+        advanced_infer are spread over a pool of that many processes.
+    cache: a solver.ComponentCache, componentCache by default.
+    watch: whether to sleep WATCH_DELAY every step, WATCH by default.
+    recorder: an instrument.Recorder of the phase timings and moves.
+    moveSeconds, moveNodes: the search budget of a move, MOVE_SECONDS and
+        MOVE_NODES by default.
+    budget: the solver.Budget of the current move.
+    budgetOuts: how many moves ran out of budget.
+    phase: the phase that found the last move, 'first', 'queued' (found
+        by an earlier phase), one of PHASES or 'guess'.
+    searchField: a SearchField of position to Slot or Node.
+    uncoveredCount: how many positions are uncovered.
+    safeCount: how many slots are known safe but not uncovered yet.
+    bounds: [min i, max i, min j, max j] of the uncovered positions.
+    componentList: the components of the frontier, None when the frontier
+        changed since they were split.
+    records: a dict of component signature to its ComponentRecord, for the
+        components of the frontier.
+    """
+    MAX_FPS = 30
+    def __init__(self, game, workers=0):
         super().__init__(game)
-        self.searchField = {p:Slot(p, []) for p in game.positions}
+        self.searchField = SearchField(self)
+        self.compactSize = COMPACT_MIN
+        self.uncoveredCount = 0
+        self.safeCount = 0
+        self.bounds = None
+        self.componentList = None
+        self.records = {}
         self.availNodes = set()
         self.safeSlots = []
 
@@ -149,19 +302,287 @@ class AIClient(client.Client):
 
         self.marks = []
 
+        # worklist of nodes to run the local rules on
+        self.pending = collections.deque()
+        self.pendingSet = set()
+        # positions of slots whose component changed since the last full
+        #  deduction
+        self.dirtySlots = set()
+
+        self.workers = workers
+        self.pool = None
+        self.cache = componentCache
+        self.watch = WATCH
+        self.recorder = instrument.Recorder(RECORD_EVERY)
+        self.moveSeconds = MOVE_SECONDS
+        self.moveNodes = MOVE_NODES
+        self.budget = solver.Budget()
+        self.budgetOuts = 0
+        self.phase = None
+
     def mark_mine(self, slot):
         slot.apply(1)
         self.mineCount += 1
         self.marks.append(slot)
+        self.touch(slot.nodes)
+
+    def mark_safe(self, slot):
+        slot.apply(0)
+        self.safeCount += 1
+        self.safeSlots.append(slot)
+        self.touch(slot.nodes)
+
+    def touch(self, nodes):
+        """
+        Queue the nodes for infer() and mark their rest slots for
+        advanced_infer().
+        """
+        self.componentList = None
+        for node in sorted(nodes, key=by_pos):
+            if node not in self.availNodes: continue
+            if node not in self.pendingSet:
+                self.pendingSet.add(node)
+                self.pending.append(node)
+            self.dirtySlots.update(slot.pos for slot in node.restSlots)
+
+    def rest_mines(self):
+        """
+        The mines not marked yet, None on a field without a mine count.
+        """
+        if self.game.mineCount is None:
+            return None
+        return self.game.mineCount - self.mineCount
+
+    def interior_count(self, frontierCount):
+        """
+        How many unknown slots are next to no node, None on an unbounded
+        field. They are counted rather than listed.
+        """
+        if self.game.size is None:
+            return None
+        w, h = self.game.size
+        return w * h - self.uncoveredCount - self.mineCount - self.safeCount - frontierCount
 
     def guess(self):
-        candidates = []
-        for pos, item in self.searchField.items():
-            if isinstance(item, Slot) and item.val != 1:
-                candidates.append(item)
+        try:
+            probs, interiorProb, interiorCount = self.mine_probabilities()
+        except solver.BudgetExceeded:
+            probs, interiorProb, interiorCount = self.local_probabilities()
         self.guessCount += 1
-        self.guessProbs.append(-1)
-        return random.choice(candidates)
+        hasInterior = interiorCount is None or interiorCount > 0
+        if not probs and not hasInterior:
+            self.guessProbs.append(-1)
+            return self.unknown_slot()
+        minProbability = min(probs.values(), default=None)
+        if hasInterior and (minProbability is None or interiorProb < minProbability):
+            minProbability = interiorProb
+        self.guessProbs.append(minProbability)
+        best = sorted((slot for slot, prob in probs.items() if prob == minProbability), key=by_pos)
+        if hasInterior and interiorProb == minProbability:
+            # every interior slot is as good as each of best
+            if interiorCount is None or random.randrange(len(best) + interiorCount) >= len(best):
+                slot = self.interior_slot()
+                if slot is not None:
+                    return slot
+        if not best:
+            # the interior slots were the best but none was found (on an
+            #  unbounded field, or where the field is marked by hand): the
+            #  safest frontier slot then, else any unknown one
+            if not probs:
+                return self.unknown_slot()
+            minProbability = min(probs.values())
+            best = sorted((slot for slot, prob in probs.items() if prob == minProbability), key=by_pos)
+        return random.choice(best)
+
+    def unknown_slot(self):
+        """
+        Return a random unknown slot of searchField, else of a bounded
+        field, else on an unbounded field the first unknown position around
+        what was uncovered. None if there is none.
+        """
+        unknown = lambda pos: self.field.get(pos, self.FLD_UNKNOWN) == self.FLD_UNKNOWN
+        slots = sorted((item for item in self.searchField.values()
+                        if isinstance(item, Slot) and item.val is None and unknown(item.pos)),
+                       key=by_pos)
+        if slots:
+            return random.choice(slots)
+        if self.game.size is not None:
+            w, h = self.game.size
+            positions = [pos for pos in itertools.product(range(w), range(h)) if unknown(pos)]
+            return self.searchField[random.choice(positions)] if positions else None
+        mi, xi, mj, xj = self.bounds
+        for r in itertools.count(1):
+            for i in range(mi - r, xi + r + 1):
+                edge = i in (mi - r, xi + r)
+                for j in range(mj - r, xj + r + 1) if edge else (mj - r, xj + r):
+                    if unknown((i, j)):
+                        return self.searchField[i, j]
+
+    def interior_slot(self):
+        """
+        Return a random interior slot, None if there is none. Random
+        positions are tried first, the field is only scanned when they keep
+        missing, that is when few interior slots are left.
+        """
+        for k in range(INTERIOR_TRIES):
+            pos = self.random_position()
+            if self.is_interior(pos):
+                return self.searchField[pos]
+        if self.game.size is None:
+            return None
+        interior = self.interior_slots()
+        return random.choice(interior) if interior else None
+
+    def interior_slots(self):
+        """
+        Scan a bounded field for all its interior slots.
+        """
+        w, h = self.game.size
+        return [self.searchField[pos] for pos in itertools.product(range(w), range(h))
+                if self.is_interior(pos)]
+
+    def random_position(self):
+        if self.game.size is not None:
+            w, h = self.game.size
+            return random.randrange(w), random.randrange(h)
+        # around what was uncovered so far
+        mi, xi, mj, xj = self.bounds
+        return random.randint(mi - 2, xi + 2), random.randint(mj - 2, xj + 2)
+
+    def is_interior(self, pos):
+        if self.field.get(pos, self.FLD_UNKNOWN) != self.FLD_UNKNOWN:
+            return False
+        item = self.searchField.get(pos)
+        return item is None or isinstance(item, Slot) and item.val is None and not item.nodes
+
+    def mine_weights(self):
+        """
+        Count the boards behind mine_probabilities().
+
+        Solutions are counted per component and grouped by mine count, a
+        big component by a dynamic program rather than one by one (see
+        solver.Component.count), so a wide frontier stays in budget. A
+        combination of components using M mines in total stands for
+        C(I, R - M) boards, where I is the number of interior slots (unknown
+        slots next to no node) and R the number of mines not marked yet. On
+        an unbounded field every position holds a mine with probability
+        p = game.density, and the combination weighs (p / (1 - p))^M.
+        Return (components, numerators, total, interiorMines,
+        interiorCount): numerators[k][i] weighs the boards with a mine at
+        bit i of components[k], total all boards and interiorMines the
+        mines they put on the interior. They are integers on a bounded
+        field.
+        """
+        restMines = self.rest_mines()
+        components = self.components()
+        results = [self.cache.count(component, self.budget) for component in components]
+        interiorCount = self.interior_count(sum(map(len, components)))
+        # weights of mine totals over the components before/after each one
+        before = [{0: 1}]
+        for counts, bitCounts in results:
+            before.append(convolve(before[-1], counts))
+        after = [{0: 1}]
+        for counts, bitCounts in reversed(results):
+            after.append(convolve(after[-1], counts))
+        after.reverse()
+        if restMines is None:
+            odds = self.game.density / (1 - self.game.density)
+            weight = lambda M: odds ** M
+        else:
+            weight = lambda M: math.comb(interiorCount, restMines - M) if 0 <= restMines - M else 0
+        total = sum(w * weight(M) for M, w in before[-1].items())
+        numerators = []
+        for k, (component, (counts, bitCounts)) in enumerate(zip(components, results)):
+            others = convolve(before[k], after[k + 1])
+            perSlot = [0] * len(component)
+            for m, perBit in bitCounts.items():
+                factor = sum(w * weight(m + M) for M, w in others.items())
+                for i, c in enumerate(perBit):
+                    perSlot[i] += c * factor
+            numerators.append(perSlot)
+        if restMines is None:
+            interiorMines = None
+        else:
+            interiorMines = sum(w * weight(M) * (restMines - M) for M, w in before[-1].items())
+        return components, numerators, total, interiorMines, interiorCount
+
+    def mine_probabilities(self):
+        """
+        Exact probability of a mine for every unknown slot, see
+        mine_weights(). Return (probs, interiorProb, interiorCount), probs
+        is a dict of frontier slot to probability, interiorProb the
+        probability of each interior slot, interiorCount as
+        interior_count().
+        """
+        components, numerators, total, interiorMines, interiorCount = self.mine_weights()
+        if total == 0:
+            return {}, 0, interiorCount
+        probs = {}
+        for component, perSlot in zip(components, numerators):
+            for key, numerator in zip(component.keys, perSlot):
+                probs[self.searchField[key]] = numerator / total
+        if interiorMines is None:
+            interiorProb = self.game.density
+        elif interiorCount:
+            interiorProb = interiorMines / (total * interiorCount)
+        else:
+            interiorProb = 0
+        return probs, interiorProb, interiorCount
+
+    def endgame(self):
+        """
+        When few mines are left the total mine count decides more than the
+        components on their own: weigh the frontier and the interior
+        together under the exact count (mine_weights), and take every slot
+        that is a mine, or safe, on all the boards left.
+        """
+        restMines = self.rest_mines()
+        if restMines is None or restMines > ENDGAME_MINES:
+            return None
+        self.show("Endgame...")
+        components, numerators, total, interiorMines, interiorCount = self.mine_weights()
+        if total == 0:
+            return None
+        for component, perSlot in zip(components, numerators):
+            for key, numerator in zip(component.keys, perSlot):
+                slot = self.searchField[key]
+                if slot.val is not None: continue
+                if numerator == 0:
+                    self.mark_safe(slot)
+                elif numerator == total:
+                    self.mark_mine(slot)
+        if interiorCount:
+            if interiorMines == 0:
+                # all of them are safe, one is enough to go on with
+                slot = self.interior_slot()
+                if slot is not None:
+                    self.mark_safe(slot)
+            elif interiorMines == total * interiorCount:
+                for slot in self.interior_slots():
+                    self.mark_mine(slot)
+        return self.get_safe_slot() or self.infer()
+
+    def local_probabilities(self):
+        """
+        A cheap estimate in the form of mine_probabilities(), for when the
+        budget does not allow the exact one: a frontier slot gets the
+        highest density of mines among its nodes, an interior slot the
+        density of the mines left over the unknown slots.
+        """
+        probs = {}
+        for node in self.availNodes:
+            if not node.restSlots: continue
+            density = node.count / len(node.restSlots)
+            for slot in node.restSlots:
+                probs[slot] = max(probs.get(slot, 0), density)
+        interiorCount = self.interior_count(len(probs))
+        restMines = self.rest_mines()
+        if restMines is None:
+            interiorProb = self.game.density
+        else:
+            unknown = interiorCount + len(probs)
+            interiorProb = restMines / unknown if unknown else 0
+        return probs, interiorProb, interiorCount
 
     def search_safe_slot(self):
         self.show("Searching...")
@@ -170,20 +591,115 @@ class AIClient(client.Client):
         for slot in self.unknown_active_slots():
             key = sum(node.get_choice_count() for node in slot.nodes)
             slots.append((key, slot))
-        slots.sort(key=lambda x: x[0])
+        slots.sort(key=lambda x: (x[0], x[1].pos))
+        compOf = self.component_map()
+        maxMines = self.rest_mines()
+        if self.workers and len(slots) >= PARALLEL_MIN_SLOTS:
+            safe, unchecked = self.parallel_forced(compOf, [slot.pos for key, slot in slots], 1, maxMines)
+            for pos in safe:
+                self.safeSlots.append(self.searchField[pos])
+            if DEBUG: print('</search_safe_slot>')
+            slot = self.get_safe_slot()
+            if not slot and unchecked:
+                self.budget.fail()
+            return slot
         for key, slot in slots:
-            slot.apply(1)
-            self.mineCount += 1
-            found = False
-            for solution in self.search([], 1):
-                found = True
-            self.mineCount -= 1
-            slot.undo()
-            if not found:
+            component = compOf.get(slot.pos)
+            if component is None: continue
+            # if no solution has a mine there, the slot is safe
+            if not self.can_take(component, slot.pos, 1, maxMines):
                 if DEBUG: print('</search_safe_slot>')
                 return slot
         if DEBUG: print('</search_safe_slot>')
 
+    def can_take(self, component, pos, val, maxMines):
+        """
+        Whether some solution of component puts val at pos. The answer is
+        kept in the record of the component, for the next calls and moves.
+        A small component is counted once through the cache, a big one is
+        searched.
+        """
+        record = self.record_of(component, maxMines)
+        i = component.index[pos]
+        known = record.answer(i, val)
+        if known is not None:
+            if known and instrument.ENABLED: instrument.counters['witness'] += 1
+            return known
+        bit = 1 << i
+        budget = self.budget
+        if len(component) > CACHE_MAX_SLOTS:
+            if val:
+                solution = component.solve(mines=bit, maxMines=maxMines, budget=budget)
+            else:
+                solution = component.solve(safes=bit, maxMines=maxMines, budget=budget)
+            record.found(val, bit, solution)
+            return solution is not None
+        if record.forced is None:
+            record.forced = self.cache.forced(component, maxMines, budget)
+        safes, mines = record.forced
+        return not (bit & (safes if val else mines))
+
+    def record_of(self, component, maxMines):
+        """
+        Return the ComponentRecord of component, moved to maxMines.
+        """
+        key = component.signature()
+        record = self.records.get(key)
+        if record is None:
+            record = self.records[key] = ComponentRecord(len(component))
+        record.limit(maxMines)
+        return record
+
+    def parallel_forced(self, compOf, positions, val, maxMines):
+        """
+        Check on the process pool which positions can not take val. Each
+        work unit is an encoded component and a chunk of its bits, with the
+        seconds and nodes left in the budget (so together the workers may
+        search more nodes than that); the nodes they search are charged to
+        the budget afterwards. Return (forced, unchecked), unchecked are the
+        positions a worker had no budget left for.
+        """
+        groups = {}
+        forced = []
+        for pos in positions:
+            component = compOf.get(pos)
+            if component is None: continue
+            i = component.index[pos]
+            known = self.record_of(component, maxMines).answer(i, val)
+            if known is False:
+                forced.append(pos)
+            elif known is None:
+                groups.setdefault(id(component), (component, []))[1].append(i)
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        futures = []
+        for component, indices in groups.values():
+            encoded = solver.encode(component)
+            chunk = max(1, -(-len(indices) // self.workers))
+            for k in range(0, len(indices), chunk):
+                future = self.pool.submit(solver.forced_bits, encoded, indices[k:k+chunk], val,
+                                          maxMines, self.budget.nodes, self.budget.remaining_seconds())
+                futures.append((component, future))
+        unchecked = []
+        for component, future in futures:
+            record = self.record_of(component, maxMines)
+            bitsForced, bitsUnchecked, spent = future.result()
+            for i in bitsForced:
+                record.found(val, 1 << i, None)
+                forced.append(component.keys[i])
+            unchecked.extend(component.keys[i] for i in bitsUnchecked)
+            if self.budget.nodes is not None:
+                self.budget.nodes -= spent
+        return forced, unchecked
+
+    def resume(self):
+        try:
+            super().resume()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
     def unknown_active_slots(self):
         for pos, item in self.searchField.items():
             if isinstance(item, Slot):
@@ -192,50 +708,71 @@ class AIClient(client.Client):
                     yield slot
 
     def advanced_infer(self):
+        """
+        Full deduction: a slot is a mine if no solution of its component
+        leaves it safe. Only the components around dirty slots are checked,
+        the others have not changed since they were checked last time. If
+        the budget runs out, the unchecked ones are left dirty.
+        """
         self.show("Advanced infering...")
-        exist = True
-        while exist:
-            exist = False
-            for slot in self.unknown_active_slots():
-                slot.apply(0)
-                found = False
-                # if no solution found when slot.val = 0, then
-                #  slot.val = 1. We can then apply it and try
-                #  a simple infer
-                for solution in self.search([], 1):
-                    found = True
-                slot.undo()
-                if found: continue
-                exist = True
-                self.mark_mine(slot)
+        while self.dirtySlots:
+            compOf = self.component_map()
+            components = {id(compOf[pos]): compOf[pos] for pos in sorted(self.dirtySlots) if pos in compOf}
+            components = list(components.values())
+            self.dirtySlots = set()
+            maxMines = self.rest_mines()
+            if self.workers and sum(map(len, components)) >= PARALLEL_MIN_SLOTS:
+                positions = [pos for component in components for pos in component.keys]
+                mines, unchecked = self.parallel_forced(compOf, positions, 0, maxMines)
+                for pos in mines:
+                    slot = self.searchField[pos]
+                    if slot.val is None:
+                        self.mark_mine(slot)
+                # the ones a worker stopped short of are checked next time
+                self.dirtySlots.update(unchecked)
                 slot = self.infer()
-                if slot: 
+                if slot:
                     return slot
+                if unchecked:
+                    self.budget.fail()
+                continue
+            for k, component in enumerate(components):
+                for pos in component.keys:
+                    slot = self.searchField[pos]
+                    if slot.val is not None: continue
+                    # if no solution found when slot.val = 0, then
+                    #  slot.val = 1. We can then apply it and try
+                    #  a simple infer
+                    try:
+                        if self.can_take(component, pos, 0, maxMines):
+                            continue
+                    except solver.BudgetExceeded:
+                        for component1 in components[k:]:
+                            self.dirtySlots.update(component1.keys)
+                        raise
+                    self.mark_mine(slot)
+                    slot = self.infer()
+                    if slot:
+                        # the rest is checked next time
+                        for component1 in components[k:]:
+                            self.dirtySlots.update(component1.keys)
+                        return slot
 
-    def search_safe_slot0(self, maxSolCount):
-        statistic = {}
-        solCount = 0
-        for solution in self.search([], maxSolCount):
-            solCount += 1
-            for slot in solution:
-                if slot not in statistic:
-                    statistic[slot] = [0, 0]
-                statistic[slot][slot.val] += 1
-        self.show("solution count: {}".format(solCount))
-        for slot, (c0, c1) in statistic.items():
-            if c1 == 0:
+    def search_safe_slot0(self, maxProbability=0.1):
+        probs, interiorProb, interior = self.mine_probabilities()
+        for slot, prob in probs.items():
+            if prob == 0:
                 self.safeSlots.append(slot)
-            if c0 == 0:
+            elif prob == 1:
                 if DEBUG: print('<mine>')
                 self.mark_mine(slot)
                 if DEBUG: print('</mine>')
         slot = self.get_safe_slot()
         if not slot:
             # still not found, guess the one with minimum possible to have mine
-            minProbability = 0.1
+            minProbability = maxProbability
             minSlot = None
-            for slot, (c0, c1) in statistic.items():
-                prob = c1 / (c0 + c1)
+            for slot, prob in probs.items():
                 if prob < minProbability:
                     minProbability, minSlot = prob, slot
             slot = minSlot
@@ -245,55 +782,66 @@ class AIClient(client.Client):
         return slot
 
     def get_input(self):
-        slot = None
-        while self.marks:
-            slot = self.marks.pop()
-            if not slot.outDated:
-                break
-        if slot:
-            self.show("step {}".format(self.step))
-            if WATCH: time.sleep(WATCH_DELAY)
-            return '{} {} {}'.format(self.OPR_MARK, slot.pos[0], slot.pos[1])
-        if not self.availNodes:
-            # the first step
-            i = random.randint(1, game.size[0]-1)
-            j = random.randint(1, game.size[1]-1)
-            slot = self.searchField[i, j]
-        else:
-            slot = self.get_safe_slot()
+        """
+        Emit every pending mark and forced safe slot as one batch command.
+        Only when no safe slot is known the solver phases run, and at last a
+        single guess.
+        """
+        self.recorder.begin_move()
+        self.phase = 'queued'
+        slots = self.take_valid(self.safeSlots)
+        if not slots and not self.marks:
+            slot = self.next_slot()
+            slots = [slot] + [other for other in self.take_valid(self.safeSlots) if other is not slot]
+        marks = self.take_valid(self.marks)
+        commands = [(self.OPR_MARK, slot.pos) for slot in marks]
+        commands.extend((self.OPR_UNCOVER, slot.pos) for slot in slots)
+        self.step += len(slots)
+        self.recorder.end_move(self.step, self.phase, len(slots), len(marks))
+        self.show("step {}".format(self.step))
+        if self.watch: time.sleep(WATCH_DELAY)
+        return self.format_commands(commands)
 
-        if not slot:
-            # try pick one from safeSlots
-            gTimer.tick()
-            slot = self.infer()
-            self.show("finished in {0:d}ms".format(gTimer.tick()))
-
-        if not slot: 
-            # still not found, start search 
-            # slot = self.search_safe_slot0(5000)
-            gTimer.tick()
-            slot = self.search_safe_slot()
-            self.show("finished in {0:d}ms".format(gTimer.tick()))
+    def next_slot(self):
+        """
+        Run the solver phases in turn until one finds a safe slot, guess one
+        if none does, or if the budget of the move runs out.
+        """
+        self.budget = solver.Budget(self.moveNodes, self.moveSeconds)
+        if not self.availNodes:
+            # the first step, on the position the game kept safe if any
+            self.phase = 'first'
+            if self.game.firstClick is not None:
+                i, j = self.game.firstClick
+            elif self.game.size is None:
+                i, j = 0, 0
+            else:
+                i = random.randint(1, self.game.size[0]-1)
+                j = random.randint(1, self.game.size[1]-1)
+            return self.searchField[i, j]
+        recorder = self.recorder
+        for phase in PHASES:
+            self.phase = phase
+            try:
+                slot = recorder.time(phase, getattr(self, phase))
+            except solver.BudgetExceeded:
+                self.budgetOuts += 1
+                self.show("out of budget in {}".format(phase))
+                break
+            self.show("finished in {0:d}ms".format(recorder.last_ms(phase)))
+            if slot:
+                return slot
+        # still not found, well, we guess one then.
+        self.phase = 'guess'
+        return recorder.time('guess', self.guess)
 
-        if not slot:
-            # try advanced infer
-            gTimer.tick()
-            slot = self.advanced_infer()
-            self.show("finished in {0:d}ms".format(gTimer.tick()))
-
-        if not slot: 
-            # still not found, start search 
-            # slot = self.search_safe_slot0(5000)
-            gTimer.tick()
-            slot = self.search_safe_slot()
-            self.show("finished in {0:d}ms".format(gTimer.tick()))
-        if not slot:
-            # still not found, well, we guess one then.
-            slot = self.guess()
-        self.step += 1
-        self.show("step {}".format(self.step))
-        if WATCH: time.sleep(WATCH_DELAY)
-        return '{} {} {}'.format(self.OPR_UNCOVER, slot.pos[0], slot.pos[1])
+    def take_valid(self, slots):
+        """
+        Empty a list of slots, return the ones not outdated.
+        """
+        valid = [slot for slot in slots if not slot.outDated]
+        slots.clear()
+        return valid
 
     def get_safe_slot(self):
         while self.safeSlots:
@@ -301,54 +849,117 @@ class AIClient(client.Client):
             if not slot.outDated:
                 return slot
 
-    def show_game(self):
-        if WATCH: os.system('clear')
-        super().show_game()
-
     def update(self, data):
         """
         data: an iterable, each item is a pair (pos, val)
         """
-        super().update(data)
+        # before the field is written, searchField reads it for the
+        #  positions it does not hold
         for pos, val in data:
             if val == self.FLD_MINE: continue
             self.update_field(pos, val)
+        super().update(data)
+        if len(self.searchField) > 2 * self.compactSize:
+            self.compact()
+
+    def compact(self):
+        """
+        Drop from searchField the nodes with no rest slot left and the
+        marked mines, so it mostly holds the frontier.
+        """
+        field = self.field
+        for pos, item in list(self.searchField.items()):
+            if isinstance(item, Node):
+                if not item.restSlots and item not in self.availNodes:
+                    del self.searchField[pos]
+            elif item.val == 1 and field.get(pos) == self.FLD_MARK:
+                del self.searchField[pos]
+        self.compactSize = max(COMPACT_MIN, len(self.searchField))
+
+    def frontier_constraints(self):
+        """
+        Return the available nodes as (rest slot positions, count) pairs.
+        """
+        return [(frozenset(slot.pos for slot in node.restSlots), node.count)
+                for node in sorted(self.availNodes, key=by_pos)]
+
+    def components(self):
+        """
+        Split the frontier into independent solver.Component, keyed by slot
+        positions. Components share no slot, so each one is solved on its
+        own (they are only tied by the total mine count). The split is kept
+        until the frontier changes, and the records of the components that
+        left the frontier are dropped then.
+        """
+        if self.componentList is None:
+            self.componentList = solver.split(self.frontier_constraints())
+            records = {}
+            for component in self.componentList:
+                key = component.signature()
+                if key in self.records:
+                    records[key] = self.records[key]
+            self.records = records
+        return self.componentList
+
+    def component_map(self):
+        """
+        Return a dict of slot position to its component.
+        """
+        return {key: component for component in self.components() for key in component.keys}
 
     def search(self, solution, needCount):
-        if DEBUG: print('<search availLen={}>'.format(len(self.availNodes)))
-        if not self.availNodes:
+        """
+        Yield at most needCount solutions of the available nodes. They come
+        from the bitmask core one component at a time, and are applied on
+        the Slot objects while yielded, so the Node/Slot graph can be looked
+        at as a view of each solution.
+        """
+        maxMines = self.rest_mines()
+        results = []
+        for component in self.components():
+            sols = component.first(needCount, maxMines=maxMines)
+            if not sols:
+                # one component has no solution, neither does the whole
+                return
+            results.append((component, sols))
+        curCount = 0
+        overflow = False
+        for masks in itertools.product(*(sols for component, sols in results)):
+            if maxMines is not None and sum(map(solver.popcount, masks)) > maxMines:
+                overflow = True
+                continue
+            values = [(key, mask >> i & 1)
+                      for (component, sols), mask in zip(results, masks)
+                      for i, key in enumerate(component.keys)]
+            yield from self.view_solution(values, solution)
+            curCount += 1
+            if curCount >= needCount: return
+        if curCount == 0 and overflow:
+            # the components only fit the total mine count together,
+            #  search them jointly
+            joint = solver.Component.from_constraints(self.frontier_constraints())
+            for mask in joint.first(needCount, maxMines=maxMines):
+                values = [(key, mask >> i & 1) for i, key in enumerate(joint.keys)]
+                yield from self.view_solution(values, solution)
+
+    def view_solution(self, values, solution):
+        """
+        Apply (position, value) pairs on the slots, yield the solution and
+        undo them.
+        """
+        base = len(solution)
+        for pos, val in values:
+            slot = self.searchField[pos]
+            slot.apply(val)
+            self.mineCount += val
+            solution.append(slot)
+        try:
             yield solution
-        else:
-            curCount = 0
-            pivot = self.choose_pivot()
-            if DEBUG: print('<pivot node={} choices={}>'.format(pivot, pivot.get_choice_count()))
-            self.availNodes.remove(pivot)
-            for choice in pivot.get_choices():
-                for slot, val in choice:
-                    slot.apply(val)
-                    if slot.val == 1:
-                        self.mineCount += 1
-                    solution.append(slot)
-                try:
-                    if self.mineCount <= self.game.mineCount:
-                        for solution1 in self.search(solution, needCount):
-                            if curCount < needCount:
-                                yield solution1
-                                curCount += 1
-                except RuntimeError as err:
-                    self.show("RuntimeError: {}. Avail nodes left: {}".format(err, len(self.availNodes)))
-                    print('press enter to continue...')
-                    input()
-                finally:
-                    for slot, val in choice:
-                        if slot.val == 1:
-                            self.mineCount -= 1
-                        slot.undo()
-                        solution.pop()
-                if curCount >= needCount: break
-            self.availNodes.add(pivot)
-            if DEBUG: print('</pivot>')
-        if DEBUG: print('</search>')
+        finally:
+            while len(solution) > base:
+                slot = solution.pop()
+                self.mineCount -= slot.val
+                slot.undo()
 
     def update_field(self, pos, count):
         # a slot lie at pos previously
@@ -360,63 +971,229 @@ class AIClient(client.Client):
         # apply 0 to the slot
         if slot.val is None:
             slot.apply(0)
+            self.touch(slot.nodes)
+        elif slot.val == 0:
+            self.safeCount -= 1
         slot.outDated = True
+        self.uncoveredCount += 1
+        i, j = pos
+        if self.bounds is None:
+            self.bounds = [i, i, j, j]
+        else:
+            bounds = self.bounds
+            bounds[0], bounds[1] = min(bounds[0], i), max(bounds[1], i)
+            bounds[2], bounds[3] = min(bounds[2], j), max(bounds[3], j)
         # replace the slot with a new node
         node = Node(pos, count)
         self.searchField[pos] = node
         # update the neigbour slots
-        for pos1 in get_neigs(pos, self.field):
+        for pos1 in get_neigs(pos, self.in_field):
             if isinstance(self.searchField[pos1], Slot):
                 slot = self.searchField[pos1]
                 node.restSlots.add(slot)
                 slot.add_node(node)
         # other stuff
         self.availNodes.add(node)
+        self.touch([node])
         if DEBUG: print('</update_field>')
 
     def infer(self):
+        """
+        Run the local rules on the queued nodes until a safe slot is found
+        or the queue is empty. A deduction queues the nodes around the slot
+        it decides, so the cost follows what changed.
+        """
         if DEBUG: print('<infer>')
         self.show("Infering...")
-        exist = True
-        while exist:
-            exist = False
-            for node in list(self.availNodes):
-                if node.get_choice_count() > 1: continue
-                self.availNodes.remove(node)
-                choice = next(iter(node.get_choices()))
-                if DEBUG: print('<choice {}>'.format(choice))
-                if choice:
-                    exist = True
-                for slot, val in choice:
-                    if val == 0:
-                        slot.apply(0)
-                        self.safeSlots.append(slot)
-                    else:
-                        self.mark_mine(slot)
-                if DEBUG: print('</choice>')
-                slot = self.get_safe_slot()
-                if slot: 
-                    if DEBUG: print('</infer>')
-                    return slot
+        while self.pending:
+            node = self.pending.popleft()
+            self.pendingSet.discard(node)
+            if node not in self.availNodes: continue
+            for slot, val in self.infer_node(node):
+                if slot.val is not None: continue
+                if DEBUG: print('<choice {} {}>'.format(slot, val))
+                if val == 0:
+                    self.mark_safe(slot)
+                else:
+                    self.mark_mine(slot)
+            slot = self.get_safe_slot()
+            if slot: 
+                if DEBUG: print('</infer>')
+                return slot
         if DEBUG: print('</infer>')
 
-    def choose_pivot(self):
+    def infer_node(self, node):
         """
-        Choose one pivot from the nodes. The choosed node will be
-        the most constrainted then most constraining node.
+        Return the (slot, val) pairs forced around node by the trivial rule
+        (count is 0 or all rest slots) or the subset rule: if the rest slots
+        of a node are a subset of another's, the difference holds the
+        difference of their counts.
         """
-        bestVal = pivot = None
-        for node in self.availNodes:
-            a = node.get_choice_count()
-            # if a <= 1:
-            #     return  node
-            b = len(node.restSlots)
-            val = -a, b
-            if bestVal is None or val > bestVal:
-                bestVal, pivot = val, node
-        return pivot
+        rest = node.restSlots
+        if node.count == 0 or node.count == len(rest):
+            self.availNodes.remove(node)
+            self.componentList = None
+            val = 1 if node.count else 0
+            return [(slot, val) for slot in sorted(rest, key=by_pos)]
+        forced = []
+        others = {other for slot in rest for other in slot.nodes
+                  if other is not node and other in self.availNodes}
+        for other in sorted(others, key=by_pos):
+            for a, b in ((node, other), (other, node)):
+                if not a.restSlots < b.restSlots: continue
+                diff = sorted(b.restSlots - a.restSlots, key=by_pos)
+                mines = b.count - a.count
+                if mines == 0:
+                    forced.extend((slot, 0) for slot in diff)
+                elif mines == len(diff):
+                    forced.extend((slot, 1) for slot in diff)
+        return forced
+
+class QuietAIClient(AIClient):
+    """
+    An AIClient that prints nothing and never sleeps.
+    """
+    def __init__(self, game, workers=0):
+        super().__init__(game, workers)
+        self.watch = 0
+
+    def show_game(self, force=False):
+        pass
+
+    def show(self, msg):
+        pass
+
+class GuessNeeded(Exception):
+    pass
+
+class NoGuessProbe(QuietAIClient):
+    """
+    Plays a game and raises GuessNeeded instead of guessing. A move that
+    runs out of its NO_GUESS_NODES budget guesses, so it raises too. The
+    probe has a cache of its own, as a cache hit spends no budget.
+    """
+    def __init__(self, game):
+        super().__init__(game)
+        self.moveSeconds = None
+        self.moveNodes = NO_GUESS_NODES
+        self.cache = solver.ComponentCache()
+
+    def guess(self):
+        raise GuessNeeded()
+
+def needs_guess(game):
+    """
+    Whether the solver has to guess to win game from its first click. The
+    game is restarted afterwards.
+    """
+    try:
+        NoGuessProbe(game).play()
+    except GuessNeeded:
+        return True
+    finally:
+        game.start()
+    return False
+
+def gen_no_guess(game, safe, seed=None, maxTries=100):
+    """
+    Generate mines for game until the solver can win it from safe without
+    guessing. Boards that need a guess are rejected, the k-th try uses
+    seed + k. Return the seed of the board, None if all tries failed (the
+    last board is kept then). The same seed and safe give the same board.
+    """
+    if seed is None:
+        seed = random.getrandbits(63)
+    for k in range(maxTries):
+        game.gen_mines(seed + k, safe)
+        if not needs_guess(game):
+            return seed + k
+    return None
+
+def check_wide_frontier(length=300, moveNodes=20000):
+    """
+    A field of 3 rows with mines only on the outer ones and its middle row
+    uncovered has frontier components of over a hundred slots, with far
+    too many solutions to go through. Check that a guess counts them
+    exactly under a budget of moveNodes, and that under a budget too small
+    for that it still guesses, from the local estimate, without spending
+    more than the budget.
+    """
+    rng = random.Random(0)
+    mines = {(i, j) for i in (0, 2) for j in range(length) if rng.random() < 0.3}
+    game = minesweep.MineSweep((3, length), len(mines))
+    game.mines = mines
+    game.start()
+    game.uncover_many([(1, j) for j in range(length)])
+    updated = game.get_updated()
+    for nodes, exact in ((moveNodes, True), (100, False)):
+        client = QuietAIClient(game)
+        client.cache = solver.ComponentCache()
+        client.update(updated)
+        assert max(map(len, client.components())) > 100
+        client.budget = solver.Budget(nodes)
+        slot = client.guess()
+        spent = nodes - client.budget.nodes
+        assert isinstance(slot, Slot) and slot.val is None, slot
+        assert spent <= nodes + 1 and client.budget.exceeded != exact, (nodes, spent)
+
+def check_no_guess_seed(seed=0, games=5):
+    """
+    Check that gen_no_guess gives the same boards from the same seeds. The
+    second round runs as on a machine far busier, with a MOVE_SECONDS too
+    short for any search node, and the shared cache emptied so it does
+    not answer the searches instead.
+    """
+    global MOVE_SECONDS
+    moveSeconds, clockEvery = MOVE_SECONDS, solver.Budget.CLOCK_EVERY
+    rounds = []
+    try:
+        for k in range(2):
+            maps = []
+            for i in range(games):
+                game = minesweep.MineSweep((16, 30), 99)
+                picked = gen_no_guess(game, (8, 15), seed + 1000 * i)
+                maps.append((picked, game.to_map()))
+                # as simulate.py does: a game played on the board
+                random.seed(i)
+                QuietAIClient(game).play()
+            rounds.append(maps)
+            MOVE_SECONDS, solver.Budget.CLOCK_EVERY = 1e-6, 1
+            componentCache.entries.clear()
+    finally:
+        MOVE_SECONDS, solver.Budget.CLOCK_EVERY = moveSeconds, clockEvery
+    assert rounds[0] == rounds[1]
+
+def check_guess_fallback():
+    """
+    A guess on a 5x5 field with its center uncovered, a 4, and the rest of
+    the field but the center's neighbours marked by hand: the client does
+    not count those marks as mines, so the interior slots are the best
+    guess by count, but none is left. Check that it guesses a frontier
+    slot, the safest left.
+    """
+    center = 2, 2
+    ring = [(i, j) for i in range(1, 4) for j in range(1, 4) if (i, j) != center]
+    outer = [(i, j) for i in range(5) for j in range(5) if (i, j) not in ring and (i, j) != center]
+    game = minesweep.MineSweep((5, 5), 6)
+    game.mines = set(ring[::2]) | {outer[0], outer[-1]}
+    for seed in range(20):
+        client = QuietAIClient(game)
+        game.start()
+        game.uncover(center)
+        client.update(game.get_updated())
+        client.mark_many(outer)
+        random.seed(seed)
+        slot = client.guess()
+        assert slot is not None and slot.pos in ring, slot
 
 if __name__ == '__main__':
+    if '-c' in sys.argv[1:]:
+        # check the solver on boards made for it, then exit
+        check_wide_frontier()
+        check_no_guess_seed()
+        check_guess_fallback()
+        print('ok')
+        sys.exit()
     if '-l' in sys.argv[1:]:
         print('load last map')
         game = minesweep.MineSweep.load('last_map')
@@ -424,9 +1201,20 @@ if __name__ == '__main__':
         W, H = 35, 80
         count = int(W * H * 0.18)
         game = minesweep.MineSweep((W, H), count)
-        game.gen_mines()
+        game.gen_mines(safe=(W // 2, H // 2))
         game.save('last_map')
+    if '-p' in sys.argv[1:]:
+        # keep the solver counters and write every move to last_trace.jsonl
+        instrument.enable()
     ai = AIClient(game)
+    if '-g' in sys.argv[1:]:
+        # stream the moves to last_game.mslog, see gamelog.py
+        import gamelog
+        ai.log = gamelog.GameWriter('last_game.mslog')
     ai.play()
+    if ai.log is not None:
+        ai.log.close()
     print('guess count:', ai.guessCount)
+    if instrument.ENABLED:
+        ai.recorder.write_jsonl('last_trace.jsonl')
     # print('guesses\' probability:', ai.guessProbs)
@@ -0,0 +1,323 @@
+import gc
+import random
+import numpy as np
+import mapfile
+import minesweep
+
+# the offsets of a position and its 8 neighbours
+NEIG_DI = np.repeat(np.arange(-1, 2), 3)
+NEIG_DJ = np.tile(np.arange(-1, 2), 3)
+
+# a region of more than 1/REGION_MASK_RATIO of the field is opened through
+#  a field wide mask
+REGION_MASK_RATIO = 64
+
+class ArrayMineSweep:
+    """
+    A mine sweeper engine backed by NumPy grids. It has the same interface
+    as minesweep.MineSweep, but it does not create a python object for each
+    position, so a big field (say 2000x2000) starts in milliseconds.
+
+    members:
+
+    mines: a bool grid, mines[i, j] is True if (i, j) has a mine.
+    packedMines: the packed mine bitmap a loaded game is unpacked from in
+        start(). It is a view of the map file, not a copy.
+    seed: the seed the mines were generated from, None if unknown.
+    firstClick: the position kept free of mines by gen_mines, or None.
+    neigMineCount: an int8 grid, how many mines are around each position.
+    uncovered: a bool grid, the bitmap of uncovered positions.
+    labelRegions: if True, start() labels the connected zero regions, and
+        uncover() opens a whole region and its border in one bulk operation.
+    regionOf: an int32 grid of region ids, -1 for non-zero positions
+        (labelRegions only).
+    regionCells, regionStart: flat indices of the zero positions sorted by
+        region, region r is regionCells[regionStart[r]:regionStart[r+1]]
+        (labelRegions only).
+    positions: a set of valid positions. It is built on demand, only clients
+        that keep a dict per position need it.
+
+    methods:
+    uncover(pos)
+    uncover_many(positions)
+    start()
+    get_updated()
+    get_state()
+    """
+    lossRevealsField = True
+
+    def __init__(self, size, mineCount, labelRegions=False):
+        self.size = w, h = size
+        self.mineCount = mineCount
+        if mineCount > w * h:
+            raise Exception("field with size {}x{} can not hold {} mines".format(w, h, mineCount))
+        self.state = 'not_start'
+        self.mines = None
+        self.packedMines = None
+        self.seed = None
+        self.firstClick = None
+        self.updated = None
+        self.labelRegions = labelRegions
+
+    @property
+    def positions(self):
+        w, h = self.size
+        return {(i, j) for i in range(w) for j in range(h)}
+
+    def gen_mines(self, seed=None, safe=None, strategy='sample'):
+        """
+        Place the mines, see minesweep.MineSweep.gen_mines. The mines are
+        drawn by a numpy Generator seeded with seed.
+        """
+        if seed is None:
+            seed = random.getrandbits(63)
+        rng = np.random.default_rng(seed)
+        w, h = self.size
+        excluded = minesweep.safe_zone(self.size, self.mineCount, safe)
+        if strategy == 'sample':
+            picked = minesweep.sample_mines(
+                    lambda n, k: rng.choice(n, k, replace=False).tolist(),
+                    w * h, self.mineCount, excluded)
+        elif strategy == 'shuffle':
+            picked = rng.permutation(w * h)
+            if excluded:
+                picked = picked[~np.isin(picked, list(excluded))]
+            picked = picked[:self.mineCount]
+        else:
+            raise ValueError("unknown strategy {!r}".format(strategy))
+        mines = np.zeros(w * h, dtype=bool)
+        mines[picked] = True
+        self.mines = mines.reshape(self.size)
+        self.seed = seed
+        self.firstClick = safe
+
+    def start(self):
+        """
+        Start the game play
+        """
+        if self.mines is None and self.packedMines is not None:
+            w, h = self.size
+            mines = np.unpackbits(self.packedMines, count=w * h, bitorder='little')
+            self.mines = mines.astype(bool).reshape(self.size)
+        assert self.mines is not None
+        self.uncovered = np.zeros(self.size, dtype=bool)
+        self.uncoveredCount = 0
+        self.neigMineCount = count_neig_mines(self.mines)
+        if self.labelRegions:
+            zero = (self.neigMineCount == 0) & ~self.mines
+            self.regionOf = label_regions(zero)
+            flat = self.regionOf.ravel()
+            self.regionCells = np.flatnonzero(zero)
+            self.regionCells = self.regionCells[np.argsort(flat[self.regionCells], kind='stable')]
+            regionCount = int(flat.max()) + 1
+            self.regionStart = np.searchsorted(flat[self.regionCells], np.arange(regionCount + 1))
+        self.state = 'running'
+
+    def in_field(self, pos):
+        i, j = pos
+        return 0 <= i < self.size[0] and 0 <= j < self.size[1]
+
+    def uncover(self, pos):
+        """
+        Uncover a position. User can then call get_updated to get results.
+        """
+        if self.state != 'running':
+            self.updated = None
+            return
+        if not self.in_field(pos) or self.uncovered[pos]:
+            self.updated = None
+            return
+        if self.mines[pos]:
+            self.updated = self.all_positions()
+            self.state = 'lost'
+            return
+
+        w, h = self.size
+        if self.labelRegions:
+            self.uncover_region(pos)
+            if self.uncoveredCount + self.mineCount == w * h:
+                self.state = 'win'
+            return
+        counts = self.neigMineCount
+        uncovered = self.uncovered
+        self.updated = updated = []
+        stk = [pos]
+        uncovered[pos] = True
+        while stk:
+            p0 = stk.pop()
+            x = int(counts[p0])
+            updated.append((p0, x))
+            if x != 0:
+                continue
+            i, j = p0
+            for i1 in range(max(i - 1, 0), min(i + 2, w)):
+                for j1 in range(max(j - 1, 0), min(j + 2, h)):
+                    # a zero position has no mine around
+                    if not uncovered[i1, j1]:
+                        uncovered[i1, j1] = True
+                        stk.append((i1, j1))
+        self.uncoveredCount += len(updated)
+        if self.uncoveredCount + self.mineCount == w * h:
+            self.state = 'win'
+
+    def uncover_region(self, pos):
+        """
+        Open the labeled region of pos and its border in one go.
+        """
+        w, h = self.size
+        rid = self.regionOf[pos]
+        if rid < 0:
+            opened = np.array([pos[0] * h + pos[1]])
+        else:
+            cells = self.regionCells[self.regionStart[rid]:self.regionStart[rid+1]]
+            ci, cj = np.divmod(cells, h)
+            i1 = (ci[:, None] + NEIG_DI).ravel()
+            j1 = (cj[:, None] + NEIG_DJ).ravel()
+            valid = (i1 >= 0) & (i1 < w) & (j1 >= 0) & (j1 < h)
+            opened = i1[valid] * h + j1[valid]
+            if len(cells) * REGION_MASK_RATIO < w * h:
+                # sorted and distinct in time of the region size
+                opened = np.unique(opened)
+                opened = opened[~self.uncovered.ravel()[opened]]
+            else:
+                # a region of much of the field sorts slower than a mask
+                mask = np.zeros(w * h, dtype=bool)
+                mask[opened] = True
+                opened = np.flatnonzero(mask & ~self.uncovered.ravel())
+        self.uncovered.ravel()[opened] = True
+        self.uncoveredCount += len(opened)
+        self.updated = position_pairs(opened, self.neigMineCount.ravel()[opened], h)
+
+    def all_positions(self):
+        """
+        Return (position, count) pairs of the whole field, with 'M' for mines.
+        """
+        w, h = self.size
+        xs = self.neigMineCount.ravel().astype(object)
+        xs[self.mines.ravel()] = 'M'
+        return position_pairs(np.arange(w * h), xs, h)
+
+    def uncover_many(self, positions):
+        """
+        Uncover a batch of positions as one operation, see
+        minesweep.uncover_many.
+        """
+        minesweep.uncover_many(self, positions)
+
+    def get_updated(self):
+        """
+        Get last updated stuff. If success, return a list of updated (position
+        , count) pair. Return None if last operation is invalid.
+        """
+        updated, self.updated = self.updated, None
+        return updated
+
+    def get_state(self):
+        """
+        return current game state. A game state is one of the following:
+        * not_start
+        * running
+        * lost
+        * win
+        """
+        return self.state
+
+    def to_map(self):
+        """
+        Return the mine field in the mapfile format.
+        """
+        if self.mines is None:
+            # loaded and not started yet, the bitmap is still packed
+            bitmap = self.packedMines.tobytes()
+        else:
+            bitmap = np.packbits(self.mines.ravel(), bitorder='little').tobytes()
+        return mapfile.encode(self.size, self.mineCount, self.seed, bitmap, self.firstClick)
+
+    @staticmethod
+    def from_map(view):
+        """
+        Create a game from a mapfile.MapView. The mines stay packed in the
+        view until start().
+        """
+        game = ArrayMineSweep(view.size, view.mineCount)
+        game.seed = view.seed
+        game.firstClick = view.firstClick
+        game.packedMines = np.frombuffer(view.bitmap, dtype=np.uint8)
+        return game
+
+    def save(self, filename):
+        with open(filename, 'wb') as outfile:
+            outfile.write(self.to_map())
+
+    @staticmethod
+    def load(filename):
+        return ArrayMineSweep.from_map(mapfile.MapView.open(filename))
+
+def position_pairs(flat, xs, h):
+    """
+    Build the [((i, j), x), ...] list of get_updated() from flat indices.
+    Millions of small tuples would trigger the cyclic gc over and over,
+    so it is paused while building them.
+    """
+    ii, jj = np.divmod(flat, h)
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return list(zip(zip(ii.tolist(), jj.tolist()), xs.tolist()))
+    finally:
+        if enabled:
+            gc.enable()
+
+def count_neig_mines(mines):
+    """
+    Count the mines around every position with a 3x3 convolution over the
+    mine grid. Return an int8 grid of the same shape.
+    """
+    w, h = mines.shape
+    padded = np.pad(mines.astype(np.int8), 1)
+    counts = np.zeros((w, h), dtype=np.int8)
+    for di in range(3):
+        for dj in range(3):
+            counts += padded[di:di+w, dj:dj+h]
+    counts -= mines
+    return counts
+
+def label_regions(zero):
+    """
+    Label the connected (8-neighbour) regions of a bool grid. Return an int32
+    grid of compact region ids, -1 where the grid is False.
+
+    This is a vectorized union find: every position starts as its own root,
+    each round hooks the larger root of every edge under the smaller one,
+    then follows parents to the roots (pointer jumping). It takes a handful
+    of rounds even on big fields.
+    """
+    w, h = zero.shape
+    n = w * h
+    index = np.arange(n).reshape(w, h)
+    us, vs = [], []
+    for di, dj in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        rows0, rows1 = slice(0, w - di), slice(di, w)
+        cols0, cols1 = slice(max(-dj, 0), h - max(dj, 0)), slice(max(dj, 0), h + min(dj, 0))
+        both = zero[rows0, cols0] & zero[rows1, cols1]
+        us.append(index[rows0, cols0][both])
+        vs.append(index[rows1, cols1][both])
+    u, v = np.concatenate(us), np.concatenate(vs)
+    parent = np.arange(n)
+    while True:
+        ru, rv = parent[u], parent[v]
+        diff = ru != rv
+        if not diff.any():
+            break
+        u, v, ru, rv = u[diff], v[diff], ru[diff], rv[diff]
+        np.minimum.at(parent, np.maximum(ru, rv), np.minimum(ru, rv))
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+    mask = zero.ravel()
+    isRoot = mask & (parent == np.arange(n))
+    rootId = np.cumsum(isRoot, dtype=np.int32) - 1
+    ids = np.where(mask, rootId[parent], -1).astype(np.int32)
+    return ids.reshape(w, h)
@@ -0,0 +1,261 @@
+"""
+Many games of the same size at once, as stacked NumPy arrays.
+
+BatchMineSweep holds B boards as (B, w, h) grids of mines, counts and
+uncovered positions, and uncovers one position per board per step: the
+flood fill, the losses and the wins are array operations over all the
+boards. play_basic() plays them with the trivial rules of AIClient.infer,
+applied across all the boards at once, and a random guess when the rules
+find nothing. That is enough for bulk statistics, say the win rate of the
+trivial rules at several densities over tens of thousands of games.
+
+    python3 batchsweep.py -n 10000 --size 16x30 --densities 0.1,0.15,0.2
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import minesweep
+
+RUNNING = 0
+WIN = 1
+LOST = 2
+STATES = {RUNNING: 'running', WIN: 'win', LOST: 'lost'}
+
+def shifted(grids):
+    """
+    Yield the 9 views of (B, w, h) grids shifted by one position in every
+    direction (and not shifted), outside positions read as 0.
+    """
+    B, w, h = grids.shape
+    padded = np.pad(grids, ((0, 0), (1, 1), (1, 1)))
+    for di in range(3):
+        for dj in range(3):
+            yield padded[:, di:di+w, dj:dj+h]
+
+def neig_sum(grids):
+    """
+    The sum over the 8 neighbours of every position of bool grids, as int8.
+    """
+    grids = grids.astype(np.int8)
+    total = np.zeros(grids.shape, dtype=np.int8)
+    for view in shifted(grids):
+        total += view
+    return total - grids
+
+def dilate(grids):
+    """
+    The bool grids grown by one position in every direction.
+    """
+    grown = np.zeros(grids.shape, dtype=bool)
+    for view in shifted(grids):
+        grown |= view
+    return grown
+
+class BatchMineSweep:
+    """
+    members:
+
+    batch: how many boards, B.
+    size: (w, h) of every board.
+    mineCount: the mines of every board.
+    mines: a (B, w, h) bool array.
+    neigMineCount: a (B, w, h) int8 array, the mines around each position.
+    uncovered: a (B, w, h) bool array.
+    states: a (B,) int8 array of RUNNING, WIN or LOST.
+    seed, firstClick: as in minesweep.MineSweep, for all the boards.
+    updated: the (B, w, h) bool array of what the last uncover() opened.
+
+    methods:
+    uncover(moves)
+    start()
+    get_state()
+    """
+    def __init__(self, batch, size, mineCount):
+        w, h = size
+        if mineCount > w * h:
+            raise Exception("field with size {}x{} can not hold {} mines".format(w, h, mineCount))
+        self.batch = batch
+        self.size = size
+        self.mineCount = mineCount
+        self.mines = None
+        self.neigMineCount = None
+        self.uncovered = None
+        self.states = None
+        self.seed = None
+        self.firstClick = None
+        self.updated = None
+
+    def gen_mines(self, seed=None, safe=None):
+        """
+        Place the mines of every board from one numpy Generator seeded with
+        seed. If safe is a position, no board has a mine on it or around it.
+        """
+        rng = np.random.default_rng(seed)
+        w, h = self.size
+        # each board takes the mineCount positions with the lowest keys
+        keys = rng.random((self.batch, w * h))
+        excluded = minesweep.safe_zone(self.size, self.mineCount, safe)
+        if excluded:
+            keys[:, sorted(excluded)] = 2
+        mines = np.zeros((self.batch, w * h), dtype=bool)
+        if self.mineCount:
+            picked = np.argpartition(keys, self.mineCount - 1, axis=1)[:, :self.mineCount]
+            np.put_along_axis(mines, picked, True, axis=1)
+        self.mines = mines.reshape(self.batch, w, h)
+        self.seed = seed
+        self.firstClick = safe
+
+    def start(self):
+        assert self.mines is not None
+        self.neigMineCount = neig_sum(self.mines)
+        self.uncovered = np.zeros(self.mines.shape, dtype=bool)
+        self.states = np.full(self.batch, RUNNING, dtype=np.int8)
+
+    def uncover(self, moves):
+        """
+        Uncover moves[b] = (i, j) on every running board b; a row with i < 0
+        is no move. The zero positions opened flood their neighbours, a
+        mine loses its board. What was opened is kept in updated.
+        """
+        w, h = self.size
+        moves = np.asarray(moves)
+        i, j = moves[:, 0], moves[:, 1]
+        valid = (self.states == RUNNING) & (i >= 0) & (i < w) & (j >= 0) & (j < h)
+        rows = np.flatnonzero(valid)
+        i, j = i[rows], j[rows]
+        fresh = ~self.uncovered[rows, i, j]
+        rows, i, j = rows[fresh], i[fresh], j[fresh]
+        hit = self.mines[rows, i, j]
+        self.states[rows[hit]] = LOST
+        rows, i, j = rows[~hit], i[~hit], j[~hit]
+        opened = np.zeros(self.mines.shape, dtype=bool)
+        opened[rows, i, j] = True
+        # grow the opened positions from their zeros until no board changes,
+        #  dropping the boards that stopped
+        sub = opened[rows]
+        while rows.size:
+            zero = self.neigMineCount[rows] == 0
+            free = ~(self.mines[rows] | self.uncovered[rows])
+            grown = sub | (dilate(sub & zero) & free)
+            changed = (grown != sub).any(axis=(1, 2))
+            opened[rows] = grown
+            rows, sub = rows[changed], grown[changed]
+        self.uncovered |= opened
+        self.updated = opened
+        won = (self.states == RUNNING) & \
+                (self.uncovered.sum(axis=(1, 2)) + self.mineCount == w * h)
+        self.states[won] = WIN
+
+    def get_state(self):
+        """
+        Return the states of the boards as an array, see STATES.
+        """
+        return self.states
+
+def trivial_inference(uncovered, counts, marks):
+    """
+    Apply the trivial rules of AIClient.infer_node on (B, w, h) grids until
+    nothing changes: around an uncovered position whose count needs all of
+    its unknown neighbours they are mines, around one whose count is met by
+    its marked neighbours they are safe. marks is updated in place; return
+    the bool grids of the known safe positions.
+    """
+    while True:
+        unknown = ~(uncovered | marks)
+        unknownAround = neig_sum(unknown)
+        marked = neig_sum(marks)
+        node = uncovered & (unknownAround > 0)
+        mines = dilate(node & (counts - marked == unknownAround)) & unknown
+        if not mines.any():
+            break
+        marks |= mines
+    return dilate(node & (counts == marked)) & unknown
+
+def play_basic(game, seed=None):
+    """
+    Play every board of a started game to its end, one move per board per
+    step: a safe position of trivial_inference(), the first in row major
+    order, or a random unknown one if there is none. The first move is the
+    firstClick of the game, or a guess. The safe positions found are kept,
+    the rules only run again on a board once it has used them all. Return
+    the (B,) array of guesses.
+    """
+    rng = np.random.default_rng(seed)
+    w, h = game.size
+    marks = np.zeros(game.mines.shape, dtype=bool)
+    safe = np.zeros(game.mines.shape, dtype=bool)
+    guesses = np.zeros(game.batch, dtype=np.int32)
+    moves = np.full((game.batch, 2), -1)
+    if game.firstClick is not None:
+        moves[:] = game.firstClick
+        game.uncover(moves)
+    flatSafe = safe.reshape(game.batch, -1)
+    while True:
+        running = game.states == RUNNING
+        if not running.any():
+            break
+        # whole array operations are cheaper here than picking the rows
+        safe &= ~game.uncovered
+        hasSafe = flatSafe.any(axis=1)
+        stale = np.flatnonzero(running & ~hasSafe)
+        if stale.size:
+            boardMarks = marks[stale]
+            safe[stale] = trivial_inference(game.uncovered[stale], game.neigMineCount[stale],
+                                            boardMarks)
+            marks[stale] = boardMarks
+            hasSafe[stale] = flatSafe[stale].any(axis=1)
+        pick = flatSafe.argmax(axis=1)
+        guessing = np.flatnonzero(running & ~hasSafe)
+        if guessing.size:
+            unknown = ~(game.uncovered[guessing] | marks[guessing]).reshape(guessing.size, -1)
+            pick[guessing] = np.where(unknown, rng.random(unknown.shape), -1).argmax(axis=1)
+            guesses[guessing] += 1
+        moves[:] = -1
+        rows = np.flatnonzero(running)
+        moves[rows, 0], moves[rows, 1] = np.divmod(pick[rows], h)
+        game.uncover(moves)
+    return guesses
+
+def run(batch, size, density, seed=0, board='safe'):
+    """
+    Play batch boards of size at density with play_basic, return a dict of
+    the results. board is 'safe' (the first click at the center opens a
+    region) or 'random'.
+    """
+    w, h = size
+    mineCount = round(density * w * h)
+    start = time.perf_counter()
+    game = BatchMineSweep(batch, size, mineCount)
+    game.gen_mines(seed, (w // 2, h // 2) if board == 'safe' else None)
+    game.start()
+    guesses = play_basic(game, seed + 1)
+    wins = int((game.states == WIN).sum())
+    return {
+        'density': density,
+        'mines': mineCount,
+        'games': batch,
+        'wins': wins,
+        'win_rate': wins / batch if batch else None,
+        'guesses_per_game': float(guesses.mean()) if batch else None,
+        'seconds': time.perf_counter() - start,
+        }
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="win rates of the trivial rules over batches of boards")
+    parser.add_argument('-n', '--batch', type=int, default=10000)
+    parser.add_argument('--size', type=minesweep.parse_size, default=(16, 30), help='WxH, default 16x30')
+    parser.add_argument('--densities', default='0.1,0.15,0.2',
+                        help='comma separated, default %(default)s')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-b', '--board', choices=('safe', 'random'), default='safe')
+    args = parser.parse_args(argv)
+    results = [run(args.batch, args.size, float(density), args.seed, args.board)
+               for density in args.densities.split(',')]
+    print(json.dumps({'size': list(args.size), 'board': args.board, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,403 @@
+"""
+Benchmarks of the engine and solver hot paths, with a regression gate.
+
+    python3 bench.py                  # run all, print the timings as JSON
+    python3 bench.py -k uncover       # only the ones whose name has uncover
+    python3 bench.py --save           # store the timings as the baseline
+    python3 bench.py --check          # exit 1 if one got slower than the baseline
+
+Every benchmark runs on a fixed seeded board of BOARDS, from beginner to
+2000x2000, and reports the median of its runs, see Benchmark.measure. The
+setup of a run (making the game, playing the AI to the position it starts
+from) is not timed. 'game/...' benchmarks play whole seeded games
+through simulate.run and report seconds per game, the others one call of a
+hot path. The solver runs on the backend given by --backend, see
+solver.use_backend().
+
+The baseline is a JSON file of benchmark name to seconds, and the solver
+backend they were timed with. It only means something on the machine it
+was made on, so make it there with --save before changing the code, then
+--check fails on the benchmarks slower than it by more than --threshold
+and NOISE_FLOOR both. One that is gets measured again, up to CONFIRM
+times, and its fastest median counts: a machine shared with other work
+is slow in bursts. A baseline of another backend is not compared.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import timeit
+
+import ai
+import arraysweep
+import chunksweep
+import mapfile
+import minesweep
+import simulate
+import solver
+
+SEED = 20240601
+BASELINE = 'bench_baseline.json'
+THRESHOLD = 0.25
+# a slowdown under that many seconds is noise, whatever the threshold
+NOISE_FLOOR = 1e-4
+REPEAT = 5
+# the runs of a benchmark that needs a setup for each go on until they took
+#  MIN_SECONDS in all, or there are MAX_SAMPLES, or MAX_WALL seconds passed
+#  with the setups
+MIN_SECONDS = 0.2
+MAX_SAMPLES = 50
+MAX_WALL = 5
+# how many times a benchmark slower than the baseline is measured again
+CONFIRM = 2
+
+# name: (size, mineCount)
+BOARDS = {
+    'beginner': ((9, 9), 10),
+    'intermediate': ((16, 16), 40),
+    'expert': ((16, 30), 99),
+    'dense': ((30, 30), 198),
+    'large': ((200, 200), 7200),
+    'huge': ((2000, 2000), 720000),
+    # 1% of mines, so the first click floods most of the field
+    'large-flood': ((200, 200), 400),
+    'huge-flood': ((2000, 2000), 40000),
+    }
+
+class Benchmark:
+    """
+    members:
+
+    name
+    setup: a function returning the state a run starts from.
+    run: a function of that state, the timed part.
+    reusable: whether run leaves the state as it found it, so it can be
+        called again on the same setup.
+    """
+    def __init__(self, name, setup, run, reusable=False):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.reusable = reusable
+
+    def measure(self, repeat):
+        """
+        Return the median seconds per run. A reusable run is timed repeat
+        times in loops long enough for timeit (0.2 s) on one setup, the
+        others once per setup, at least repeat times and then until
+        MIN_SECONDS, MAX_SAMPLES or MAX_WALL.
+        """
+        if self.reusable:
+            state = self.setup()
+            timer = timeit.Timer(lambda: self.run(state))
+            number, seconds = timer.autorange()
+            samples = [seconds / number]
+            samples.extend(timer.timeit(number) / number for k in range(repeat - 1))
+            return statistics.median(samples)
+        samples = []
+        wallStart = time.perf_counter()
+        while len(samples) < repeat or (sum(samples) < MIN_SECONDS and len(samples) < MAX_SAMPLES
+                                        and time.perf_counter() - wallStart < MAX_WALL):
+            state = self.setup()
+            start = time.perf_counter_ns()
+            self.run(state)
+            samples.append((time.perf_counter_ns() - start) / 1e9)
+        return statistics.median(samples)
+
+def center(size):
+    return size[0] // 2, size[1] // 2
+
+def new_game(engine, boardName, **kwargs):
+    size, mineCount = BOARDS[boardName]
+    game = engine(size, mineCount, **kwargs)
+    game.gen_mines(SEED, center(size))
+    return game
+
+def started_game(engine, boardName, **kwargs):
+    game = new_game(engine, boardName, **kwargs)
+    game.start()
+    return game
+
+def start_bench(engineName, engine, boardName, **kwargs):
+    return Benchmark('start/{}/{}'.format(engineName, boardName),
+                     lambda: new_game(engine, boardName, **kwargs),
+                     lambda game: game.start())
+
+def uncover_bench(engineName, engine, boardName, **kwargs):
+    """
+    Uncover every position without a mine, row by row, as a game won by
+    clicking everywhere does.
+    """
+    def setup():
+        game = started_game(engine, boardName, **kwargs)
+        w, h = game.size
+        mines = set(mapfile.MapView(game.to_map()).mine_positions())
+        safe = [(i, j) for i in range(w) for j in range(h) if (i, j) not in mines]
+        return game, safe
+    def run(state):
+        game, safe = state
+        for pos in safe:
+            game.uncover(pos)
+            game.get_updated()
+        assert game.get_state() == 'win'
+    return Benchmark('uncover/{}/{}'.format(engineName, boardName), setup, run)
+
+def flood_bench(engineName, setup):
+    """
+    The flood fill of a first click that opens most of the field.
+    """
+    def run(game):
+        game.uncover(game.firstClick)
+        assert len(game.get_updated()) > game.size[0] * game.size[1] // 2
+    return Benchmark('flood/' + engineName, setup, run)
+
+def chunked_game(boardName):
+    size, mineCount = BOARDS[boardName]
+    game = chunksweep.ChunkedMineSweep(size, mineCount)
+    game.gen_mines(SEED, center(size))
+    game.start()
+    return game
+
+def played_client(boardName, moves):
+    """
+    Return a QuietAIClient that played moves moves of the seeded game on
+    boardName, with a cold cache and no budget.
+    """
+    size, mineCount = BOARDS[boardName]
+    random.seed(SEED)
+    game = new_game(minesweep.MineSweep, boardName)
+    client = ai.QuietAIClient(game)
+    client.cache = solver.ComponentCache()
+    client.moveSeconds = None
+    client.maxMoves = moves
+    client.play()
+    if game.get_state() != 'running':
+        raise Exception("game on {} is over after {} moves".format(boardName, client.moves))
+    client.budget = solver.Budget()
+    return client
+
+def inferred_client(boardName, moves):
+    """
+    As played_client, with the local rules run to the end.
+    """
+    client = played_client(boardName, moves)
+    while client.infer(): pass
+    return client
+
+def get_choices(client):
+    for node in client.availNodes:
+        for choice in node.get_choices(): pass
+
+def search(client):
+    for solution in client.search([], 1000): pass
+
+def infer(client):
+    # the local rules on every node of the frontier
+    client.pending.extend(client.availNodes)
+    client.pendingSet.update(client.availNodes)
+    while client.infer(): pass
+
+def advanced_infer(client):
+    # the full deduction on every component of the frontier
+    client.dirtySlots.update(slot.pos for slot in client.unknown_active_slots())
+    while client.advanced_infer(): pass
+
+def ai_benches(boardName, moves):
+    setup = lambda: played_client(boardName, moves)
+    inferredSetup = lambda: inferred_client(boardName, moves)
+    name = '{}/' + boardName
+    return [
+        Benchmark(name.format('node.get_choices'), setup, get_choices, reusable=True),
+        Benchmark(name.format('ai.search'), inferredSetup, search),
+        Benchmark(name.format('ai.infer'), setup, infer),
+        Benchmark(name.format('ai.advanced_infer'), inferredSetup, advanced_infer),
+        Benchmark(name.format('ai.mine_probabilities'), inferredSetup,
+                  lambda client: client.mine_probabilities()),
+        ]
+
+def joint_component(boardName, moves):
+    """
+    The whole frontier of inferred_client(boardName, moves) as one
+    solver.Component.
+    """
+    client = inferred_client(boardName, moves)
+    return solver.Component.from_constraints(client.frontier_constraints())
+
+def solve_every_slot(component):
+    for i in range(len(component)):
+        component.solve(mines=1 << i)
+        component.solve(safes=1 << i)
+
+def solver_benches(boardName, moves):
+    setup = lambda: joint_component(boardName, moves)
+    return [
+        Benchmark('solver.count/' + boardName, setup, lambda component: component.count(),
+                  reusable=True),
+        Benchmark('solver.solve/' + boardName, setup, solve_every_slot, reusable=True),
+        ]
+
+def game_bench(boardName, games):
+    """
+    Whole seeded games, seconds per game.
+    """
+    size, mineCount = BOARDS[boardName]
+    def setup():
+        ai.componentCache.entries.clear()
+    def run(state):
+        simulate.run(size, mineCount, games, SEED, board='safe', budget=(None, None),
+                     backend=(solver.BACKEND, False))
+    return Benchmark('game/{}'.format(boardName), setup, run), games
+
+def benchmarks():
+    """
+    Return the list of (Benchmark, games per run) pairs, games is None but
+    for the whole game ones.
+    """
+    engines = [('minesweep', minesweep.MineSweep, {}),
+               ('minesweep-regions', minesweep.MineSweep, {'labelRegions': True}),
+               ('arraysweep', arraysweep.ArrayMineSweep, {}),
+               ('arraysweep-regions', arraysweep.ArrayMineSweep, {'labelRegions': True})]
+    benches = []
+    for engineName, engine, kwargs in engines:
+        # a MineSweep of 2000x2000 takes gigabytes
+        boardNames = ['beginner', 'expert', 'large']
+        if engine is arraysweep.ArrayMineSweep:
+            boardNames.append('huge')
+        for boardName in boardNames:
+            benches.append(start_bench(engineName, engine, boardName, **kwargs))
+        for boardName in ('expert', 'large'):
+            benches.append(uncover_bench(engineName, engine, boardName, **kwargs))
+        # only the region labels make a flood of 2000x2000 take seconds, not minutes
+        floodBoard = 'huge-flood' if engineName == 'arraysweep-regions' else 'large-flood'
+        benches.append(flood_bench('{}/{}'.format(engineName, floodBoard),
+                                   lambda e=engine, b=floodBoard, k=kwargs: started_game(e, b, **k)))
+    benches.append(flood_bench('chunksweep/large-flood', lambda: chunked_game('large-flood')))
+    benches.extend(ai_benches('expert', 12))
+    benches.extend(ai_benches('dense', 20))
+    benches.extend(ai_benches('large', 40))
+    benches.extend(solver_benches('dense', 20))
+    benches = [(bench, None) for bench in benches]
+    benches.append(game_bench('beginner', 40))
+    benches.append(game_bench('intermediate', 20))
+    benches.append(game_bench('expert', 10))
+    return benches
+
+def run(pattern=None, repeat=REPEAT, verbose=True, names=None):
+    """
+    Run the benchmarks whose name contains pattern (all if None), and is
+    in names if given, return a dict of name to seconds; a whole game one
+    is per game.
+    """
+    results = {}
+    for bench, games in benchmarks():
+        if pattern and pattern not in bench.name:
+            continue
+        if names is not None and bench.name not in names:
+            continue
+        seconds = bench.measure(repeat)
+        if games:
+            seconds /= games
+        results[bench.name] = seconds
+        if verbose:
+            extra = ' ({:.1f} games/s)'.format(1 / seconds) if games else ''
+            print('{:45s} {:12.3f} ms{}'.format(bench.name, seconds * 1000, extra),
+                  file=sys.stderr)
+    return results
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Return the (name, seconds, baseline seconds) of the results slower than
+    the baseline by more than threshold (0.25 is 25%) and NOISE_FLOOR.
+    """
+    return [(name, seconds, baseline[name]) for name, seconds in sorted(results.items())
+            if name in baseline and seconds > baseline[name] * (1 + threshold)
+            and seconds - baseline[name] > NOISE_FLOOR]
+
+def load_baseline(filename):
+    """
+    Return the benchmarks of a baseline file, raise an Exception if it was
+    timed on another solver backend than the one in use.
+    """
+    with open(filename) as infile:
+        baseline = json.load(infile)
+    backend = baseline.get('backend')
+    if backend != solver.BACKEND:
+        raise Exception("{} was timed with the {} backend, not {}, see --backend".format(
+            filename, backend, solver.BACKEND))
+    return baseline['benchmarks']
+
+def save_baseline(filename, results, pattern=None):
+    """
+    Write results to the baseline file, with the backend they were timed
+    with. With a pattern the benchmarks not run keep their baseline.
+    """
+    benchmarks = {}
+    if pattern:
+        try:
+            benchmarks = load_baseline(filename)
+        except FileNotFoundError:
+            pass
+    benchmarks.update(results)
+    with open(filename, 'w') as outfile:
+        json.dump({'python': platform.python_version(),
+                   'machine': platform.machine(),
+                   'backend': solver.BACKEND,
+                   'benchmarks': benchmarks}, outfile, indent=2, sort_keys=True)
+        outfile.write('\n')
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-k', '--pattern', help='only the benchmarks whose name contains this')
+    parser.add_argument('-r', '--repeat', type=int, default=REPEAT,
+                        help='runs of each benchmark at least, default %(default)s')
+    parser.add_argument('--baseline', default=BASELINE, help='default %(default)s')
+    parser.add_argument('--save', action='store_true', help='write the timings to the baseline')
+    parser.add_argument('--check', action='store_true',
+                        help='exit 1 if a benchmark is slower than the baseline by more than the threshold')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed slowdown, default %(default)s (25%%)')
+    parser.add_argument('-l', '--list', action='store_true', help='list the benchmark names')
+    parser.add_argument('--backend', choices=('auto', 'c', 'python'), default='auto',
+                        help='solver search, default %(default)s (c if built)')
+    args = parser.parse_args(argv)
+    solver.use_backend(args.backend)
+    if args.list:
+        for bench, games in benchmarks():
+            print(bench.name)
+        return 0
+    if args.check:
+        # before the timings, they are of no use against another backend
+        try:
+            baseline = load_baseline(args.baseline)
+        except Exception as err:
+            print(err, file=sys.stderr)
+            return 2
+    results = run(args.pattern, args.repeat)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if args.save:
+        save_baseline(args.baseline, results, args.pattern)
+    if args.check:
+        slower = compare(results, baseline, args.threshold)
+        for k in range(CONFIRM):
+            if not slower:
+                break
+            print('measuring again: ' + ', '.join(name for name, seconds, base in slower),
+                  file=sys.stderr)
+            again = run(args.pattern, args.repeat, names={name for name, seconds, base in slower})
+            for name, seconds in again.items():
+                results[name] = min(results[name], seconds)
+            slower = compare(results, baseline, args.threshold)
+        for name, seconds, base in slower:
+            print('REGRESSION {}: {:.3f} ms, baseline {:.3f} ms (+{:.0%})'.format(
+                name, seconds * 1000, base * 1000, seconds / base - 1), file=sys.stderr)
+        missing = sorted(set(results) - set(baseline))
+        if missing:
+            print('not in the baseline: ' + ', '.join(missing), file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,355 @@
+"""
+A mine sweeper engine for huge or unbounded fields.
+
+The field is cut in square tiles of TILE_SIZE x TILE_SIZE positions. A tile
+holds one byte per position for its mines and one for what is uncovered,
+and is only created when a position in it (or next to it) is touched. Its
+mines are drawn from a random.Random seeded with the game seed and the tile
+index, so a tile is the same whenever and in whatever order it is made.
+
+A bounded field spreads mineCount over the tiles, tile k (row major) gets
+floor(M*e/N) - floor(M*s/N) mines where [s, e) are its cells in row major
+order, so the total is exact. The cells of the safe zone of the first
+click (see minesweep.safe_zone) are left out of that order and of N, so
+no tile gets more mines than it has cells outside the zone. An unbounded
+field (size None) has no mine count, each tile holds density of its cells
+outside the zone, and the game never wins.
+
+    python3 chunksweep.py 10000x10000 --moves 2000   # AI on 10^8 positions
+"""
+import argparse
+import random
+import sys
+import time
+
+import minesweep
+
+TILE_SIZE = 64
+
+class ChunkedMineSweep:
+    """
+    members:
+
+    size: (w, h), or None for an unbounded field.
+    mineCount: the number of mines, None on an unbounded field.
+    density: the fraction of positions that hold a mine.
+    tileSize
+    tiles: a dict of tile index (ti, tj) to Tile, the tiles made so far.
+    uncoveredCount
+    seed, firstClick: as in minesweep.MineSweep.
+    safeZone: the set of positions kept free of mines for firstClick.
+
+    methods:
+    uncover(pos)
+    uncover_many(positions)
+    start()
+    get_updated()
+    get_state()
+    """
+    # a lost game only shows the mines of the tiles made so far
+    lossRevealsField = False
+
+    def __init__(self, size, mineCount=None, density=None, tileSize=TILE_SIZE):
+        self.size = size
+        self.tileSize = tileSize
+        if size is None:
+            if density is None:
+                raise Exception("an unbounded field needs a density")
+            self.mineCount = None
+            self.density = density
+        else:
+            w, h = size
+            if mineCount is None:
+                mineCount = round(density * w * h)
+            if mineCount > w * h:
+                raise Exception("field with size {}x{} can not hold {} mines".format(w, h, mineCount))
+            self.mineCount = mineCount
+            self.density = mineCount / (w * h)
+        self.state = 'not_start'
+        self.tiles = {}
+        self.seed = None
+        self.firstClick = None
+        self.safeZone = set()
+        self.updated = None
+        self.uncoveredCount = 0
+
+    def gen_mines(self, seed=None, safe=None):
+        """
+        Fix the seed the tiles are drawn from. If safe is a position, no
+        mine is put on it or around it, or only not on it if the field is
+        too crowded for that.
+        """
+        if seed is None:
+            seed = random.getrandbits(63)
+        self.seed = seed
+        self.firstClick = safe
+        self.tiles = {}
+        if self.size is None:
+            self.safeZone = set() if safe is None else {
+                    (i, j) for i in range(safe[0] - 1, safe[0] + 2)
+                    for j in range(safe[1] - 1, safe[1] + 2)}
+        else:
+            h = self.size[1]
+            self.safeZone = {divmod(k, h) for k in minesweep.safe_zone(self.size, self.mineCount, safe)}
+
+    def start(self):
+        assert self.seed is not None
+        self.tiles = {}
+        self.uncoveredCount = 0
+        self.state = 'running'
+
+    def in_field(self, pos):
+        if self.size is None:
+            return True
+        i, j = pos
+        return 0 <= i < self.size[0] and 0 <= j < self.size[1]
+
+    def tile_extent(self, ti, tj):
+        """
+        Return the (rows, cols) of tile (ti, tj) inside the field.
+        """
+        T = self.tileSize
+        if self.size is None:
+            return T, T
+        if ti < 0 or tj < 0:
+            return 0, 0
+        w, h = self.size
+        return max(0, min(T, w - ti * T)), max(0, min(T, h - tj * T))
+
+    def tile_mine_count(self, ti, tj):
+        T = self.tileSize
+        rows, cols = self.tile_extent(ti, tj)
+        inside = sum((i // T, j // T) == (ti, tj) for i, j in self.safeZone)
+        if self.size is None:
+            return round(self.density * (rows * cols - inside))
+        w, h = self.size
+        before = sum((i // T, j // T) < (ti, tj) for i, j in self.safeZone)
+        start = ti * T * h + rows * tj * T - before
+        end = start + rows * cols - inside
+        M, N = self.mineCount, w * h - len(self.safeZone)
+        if not N:
+            return 0
+        return M * end // N - M * start // N
+
+    def tile(self, ti, tj):
+        """
+        Return tile (ti, tj), made on first use.
+        """
+        tile = self.tiles.get((ti, tj))
+        if tile is None:
+            tile = self.tiles[ti, tj] = self.make_tile(ti, tj)
+        return tile
+
+    def make_tile(self, ti, tj):
+        T = self.tileSize
+        rows, cols = self.tile_extent(ti, tj)
+        tile = Tile(T)
+        if rows <= 0 or cols <= 0:
+            return tile
+        count = self.tile_mine_count(ti, tj)
+        # the safe zone in tile cell numbering r*cols+c
+        excluded = {(i - ti * T) * cols + j - tj * T for i, j in self.safeZone
+                    if (i // T, j // T) == (ti, tj)}
+        rng = random.Random('{}/{}/{}'.format(self.seed, ti, tj))
+        picked = minesweep.sample_mines(lambda n, k: rng.sample(range(n), k),
+                                        rows * cols, count, excluded)
+        mines = tile.mines
+        for k in picked:
+            r, c = divmod(k, cols)
+            mines[r * T + c] = 1
+        return tile
+
+    def has_mine(self, pos):
+        i, j = pos
+        T = self.tileSize
+        return self.tile(i // T, j // T).mines[i % T * T + j % T] == 1
+
+    def neig_mine_count(self, pos):
+        i, j = pos
+        T = self.tileSize
+        li, lj = i % T, j % T
+        if 0 < li < T - 1 and 0 < lj < T - 1:
+            # all neighbours are in the same tile
+            mines = self.tile(i // T, j // T).mines
+            k = li * T + lj
+            return (mines[k-T-1] + mines[k-T] + mines[k-T+1] + mines[k-1] + mines[k+1]
+                    + mines[k+T-1] + mines[k+T] + mines[k+T+1])
+        return sum(self.has_mine((i1, j1))
+                   for i1 in range(i - 1, i + 2) for j1 in range(j - 1, j + 2)
+                   if (i1, j1) != pos and self.in_field((i1, j1)))
+
+    def is_uncovered(self, pos):
+        i, j = pos
+        T = self.tileSize
+        return self.tile(i // T, j // T).uncovered[i % T * T + j % T] == 1
+
+    def set_uncovered(self, pos):
+        i, j = pos
+        T = self.tileSize
+        self.tile(i // T, j // T).uncovered[i % T * T + j % T] = 1
+
+    def uncover(self, pos):
+        """
+        Uncover a position. User can then call get_updated to get results.
+        """
+        if self.state != 'running':
+            self.updated = None
+            return
+        if not self.in_field(pos) or self.is_uncovered(pos):
+            self.updated = None
+            return
+        if self.has_mine(pos):
+            self.updated = [(pos, 'M')] + self.made_mines(pos)
+            self.state = 'lost'
+            return
+        self.updated = updated = []
+        stk = [pos]
+        self.set_uncovered(pos)
+        while stk:
+            p0 = stk.pop()
+            x = self.neig_mine_count(p0)
+            updated.append((p0, x))
+            if x != 0:
+                continue
+            i, j = p0
+            for i1 in range(i - 1, i + 2):
+                for j1 in range(j - 1, j + 2):
+                    p1 = i1, j1
+                    # a zero position has no mine around
+                    if self.in_field(p1) and not self.is_uncovered(p1):
+                        self.set_uncovered(p1)
+                        stk.append(p1)
+        self.uncoveredCount += len(updated)
+        if self.mineCount is not None and \
+                self.uncoveredCount + self.mineCount == self.size[0] * self.size[1]:
+            self.state = 'win'
+
+    def made_mines(self, exclude=None):
+        """
+        Return the (position, 'M') pairs of the mines in the tiles made so far.
+        """
+        T = self.tileSize
+        found = []
+        for (ti, tj), tile in self.tiles.items():
+            for k, mine in enumerate(tile.mines):
+                if mine:
+                    pos = ti * T + k // T, tj * T + k % T
+                    if pos != exclude:
+                        found.append((pos, 'M'))
+        return found
+
+    def uncover_many(self, positions):
+        """
+        Uncover a batch of positions as one operation, see
+        minesweep.uncover_many.
+        """
+        minesweep.uncover_many(self, positions)
+
+    def get_updated(self):
+        """
+        Get last updated stuff. If success, return a list of updated (position
+        , count) pair. Return None if last operation is invalid.
+        """
+        updated, self.updated = self.updated, None
+        return updated
+
+    def get_state(self):
+        """
+        return current game state, see minesweep.MineSweep.get_state.
+        """
+        return self.state
+
+    def new_field(self):
+        """
+        The map a client keeps of what it sees, tiled like the game.
+        """
+        return TileField(self.tileSize)
+
+class Tile:
+    """
+    members:
+
+    mines: a bytearray, 1 where there is a mine, position (li, lj) of the
+        tile is byte li*tileSize+lj.
+    uncovered: a bytearray, 1 where the position is uncovered.
+    """
+    __slots__ = ('mines', 'uncovered')
+    def __init__(self, tileSize):
+        self.mines = bytearray(tileSize * tileSize)
+        self.uncovered = bytearray(tileSize * tileSize)
+
+class TileField:
+    """
+    A dict-like map of position to what a client sees there, for fields too
+    big for a dict. It is tiled like ChunkedMineSweep with one byte per
+    position: counts 0-8 as is, other values (mines, marks) through a table
+    of codes. Positions never set read as missing.
+    """
+    MISSING = 255
+    def __init__(self, tileSize=TILE_SIZE):
+        self.tileSize = tileSize
+        self.tiles = {}
+        self.values = list(range(9))
+        self.codes = {x: x for x in range(9)}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def get(self, pos, default=None):
+        i, j = pos
+        T = self.tileSize
+        tile = self.tiles.get((i // T, j // T))
+        if tile is None:
+            return default
+        code = tile[i % T * T + j % T]
+        return default if code == self.MISSING else self.values[code]
+
+    def __getitem__(self, pos):
+        val = self.get(pos, self)
+        if val is self:
+            raise KeyError(pos)
+        return val
+
+    def __setitem__(self, pos, val):
+        code = self.codes.get(val)
+        if code is None:
+            code = self.codes[val] = len(self.values)
+            self.values.append(val)
+        i, j = pos
+        T = self.tileSize
+        tile = self.tiles.get((i // T, j // T))
+        if tile is None:
+            tile = self.tiles[i // T, j // T] = bytearray([self.MISSING]) * (T * T)
+        k = i % T * T + j % T
+        if tile[k] == self.MISSING:
+            self.count += 1
+        tile[k] = code
+
+def parse_size(text):
+    if text == 'inf':
+        return None
+    return minesweep.parse_size(text)
+
+def main(argv):
+    import ai
+    parser = argparse.ArgumentParser(description="play the AI on a chunked field")
+    parser.add_argument('size', type=parse_size, help="WxH, or inf for an unbounded field")
+    parser.add_argument('--density', type=float, default=0.16)
+    parser.add_argument('--moves', type=int, default=1000, help='stop after that many moves')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    game = ChunkedMineSweep(args.size, density=args.density)
+    game.gen_mines(args.seed, (0, 0) if args.size is None else (args.size[0] // 2, args.size[1] // 2))
+    random.seed(args.seed)
+    client = ai.QuietAIClient(game)
+    client.maxMoves = args.moves
+    start = time.perf_counter()
+    client.play()
+    print({'state': game.get_state(), 'moves': client.moves, 'steps': client.step,
+           'guesses': client.guessCount, 'uncovered': game.uncoveredCount,
+           'tiles': len(game.tiles), 'slots_and_nodes': len(client.searchField),
+           'seconds': round(time.perf_counter() - start, 2)})
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
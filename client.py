@@ -1,6 +1,23 @@
+import sys
+import time
 import minesweep
 
 class Client:
+    """
+    members:
+
+    field: a dict of position to what the player sees there, positions not
+        in it are unknown. A game may give its own map for it (new_field).
+    ansi: if True, the first frame clears the screen and later frames only
+        redraw the cells changed since the last one, with ANSI cursor
+        addressing. Defaults to whether stdout is a terminal.
+    changed: positions changed since the last frame.
+    MAX_FPS: frames drawn per second at most, 0 for no cap. Frames asked
+        for sooner are skipped, their changes go to the next one.
+    moves: how many commands were played.
+    maxMoves: stop playing after that many commands, None for no limit.
+    log: a gamelog.GameWriter every move is written to, or None.
+    """
     STATE_RUNNING = 'running'
     STATE_WIN = 'win'
     STATE_LOST = 'lost'
@@ -9,61 +26,175 @@ class Client:
     FLD_UNKNOWN = '\u25A1'
     FLD_MINE = 'M'
     FLD_MARK = '\u25A0'
-    def __init__(self, game):
+    MAX_FPS = 0
+    def __init__(self, game, ansi=None):
         self.game = game
+        self.ansi = sys.stdout.isatty() if ansi is None else ansi
+        self.changed = set()
+        self.drawn = False
+        self.lastFrameTime = None
+        self.field = {}
+        self.moves = 0
+        self.maxMoves = None
+        self.log = None
 
     def play(self):
         game = self.game
         game.start()
-        self.field = {p:self.FLD_UNKNOWN for p in game.positions}
+        self.field = game.new_field() if hasattr(game, 'new_field') else {}
+        if self.log is not None:
+            self.log.begin(self)
+        self.resume()
+
+    def resume(self):
+        """
+        Play on from where the game is, as play() does once it started it.
+        """
+        game = self.game
         while game.get_state() == self.STATE_RUNNING:
+            if self.maxMoves is not None and self.moves >= self.maxMoves:
+                break
             self.show_game()
             input = self.get_input()
-            try:
-                opr, i, j = input.split()
-                i = int(i)
-                j = int(j)
-            except ValueError:
+            self.moves += 1
+            commands = self.parse_input(input)
+            updated = None
+            if commands is None:
                 self.show("Invalid input")
-                opr = None
-            if opr == self.OPR_UNCOVER:
-                game.uncover((i, j))
-                updatedData = game.get_updated()
-                if updatedData is None:
-                    self.show("Operation '{}' ignored".format(input))
-                else:
-                    self.update(updatedData)
-                    self.show("Uncovered ({}, {})".format(i, j))
-            elif opr == self.OPR_MARK:
-                if self.field[i, j] == self.FLD_MARK:
-                    self.field[i, j] = self.FLD_UNKNOWN
-                elif self.field[i, j] == self.FLD_UNKNOWN:
-                    self.field[i, j] = self.FLD_MARK
-                else:
-                    self.show("Cannot mark there")
             else:
-                continue
+                marks = [pos for opr, pos in commands if opr == self.OPR_MARK]
+                if marks:
+                    self.mark_many(marks)
+                positions = [pos for opr, pos in commands if opr == self.OPR_UNCOVER]
+                if positions:
+                    updated = self.uncover_many(positions, input)
+            if self.log is not None:
+                self.log.write_move(self, input, updated)
+        if self.log is not None:
+            self.log.end(self)
         state = game.get_state()
-        self.show_game()
+        self.show_game(force=True)
         if state == self.STATE_WIN:
             self.show("Player win")
         elif state == self.STATE_LOST:
             self.show("Player lost")
 
-    def show_game(self):
+    def parse_input(self, input):
+        """
+        Parse a command into a list of (opr, (i, j)), None if invalid. A
+        command is 'opr i j', or several of them separated by ';' to be
+        applied as one batch.
+        """
+        commands = []
+        for part in input.split(';'):
+            try:
+                opr, i, j = part.split()
+                pos = int(i), int(j)
+            except ValueError:
+                return None
+            if opr not in (self.OPR_UNCOVER, self.OPR_MARK):
+                return None
+            commands.append((opr, pos))
+        return commands
+
+    def format_commands(self, commands):
+        """
+        The inverse of parse_input.
+        """
+        return '; '.join('{} {} {}'.format(opr, i, j) for opr, (i, j) in commands)
+
+    def uncover_many(self, positions, input=None):
+        """
+        Uncover a batch of positions in one game operation. Return what
+        game.get_updated() gave, None if the game ignored it.
+        """
+        game = self.game
+        game.uncover_many(positions)
+        updatedData = game.get_updated()
+        if updatedData is None:
+            self.show("Operation '{}' ignored".format(input or self.format_commands(
+                [(self.OPR_UNCOVER, pos) for pos in positions])))
+        else:
+            self.update(updatedData)
+            if len(positions) == 1:
+                self.show("Uncovered ({}, {})".format(*positions[0]))
+            else:
+                self.show("Uncovered {} positions".format(len(positions)))
+        return updatedData
+
+    def mark(self, pos):
+        """
+        Toggle the mark on an unknown position.
+        """
+        self.mark_many([pos])
+
+    def mark_many(self, positions):
+        """
+        Toggle the marks on a batch of unknown positions. Nothing changes if
+        one of them can not be marked.
+        """
+        field = self.field
+        if any(not self.in_field(pos) or field.get(pos, self.FLD_UNKNOWN)
+               not in (self.FLD_MARK, self.FLD_UNKNOWN) for pos in positions):
+            self.show("Cannot mark there")
+            return
+        for pos in positions:
+            field[pos] = self.FLD_UNKNOWN if field.get(pos) == self.FLD_MARK else self.FLD_MARK
+            self.changed.add(pos)
+
+    def show_game(self, force=False):
+        """
+        Draw the field in one write. Unless force is set, the frame is
+        skipped if it comes sooner than MAX_FPS allows.
+        """
+        now = time.perf_counter()
+        if not force and self.MAX_FPS and self.lastFrameTime is not None \
+                and now - self.lastFrameTime < 1 / self.MAX_FPS:
+            return
+        self.lastFrameTime = now
+        if self.ansi and self.drawn:
+            frame = self.render_delta()
+        else:
+            frame = self.render_frame()
+            self.drawn = True
+        self.changed = set()
+        sys.stdout.write(frame)
+        sys.stdout.flush()
+
+    def in_field(self, pos):
+        size = self.game.size
+        if size is None:
+            return True
+        i, j = pos
+        return 0 <= i < size[0] and 0 <= j < size[1]
+
+    def cell_text(self, pos):
+        val = self.field.get(pos, self.FLD_UNKNOWN)
+        return str(val) if val != 0 else ' '
+
+    def render_frame(self):
         n, m = self.game.size
-        print('--'*(m+1))
-        print('/ ', end='')
-        for j in range(m):
-            print(j%10, end='_\n'[j==m-1])
+        lines = ['--'*(m+1)]
+        lines.append('/ ' + ''.join('{}{}'.format(j%10, '_' if j != m-1 else '') for j in range(m)))
         for i in range(n):
-            print('{}|'.format(i % 10), end='')
-            for j in range(m):
-                val = self.field[i, j]
-                c = str(val) if val != 0 else ' '
-                print(c, end=' ')
-            print()
-        print('--'*(m+1))
+            lines.append('{}|'.format(i % 10) + ''.join(self.cell_text((i, j)) + ' ' for j in range(m)))
+        lines.append('--'*(m+1))
+        frame = '\n'.join(lines) + '\n'
+        if self.ansi:
+            # clear the screen and start at the top left corner
+            frame = '\x1b[2J\x1b[H' + frame
+        return frame
+
+    def render_delta(self):
+        """
+        Redraw the changed cells in place, then clear what was printed below
+        the field. Row i is on line i+3 and column j at column 2*j+3.
+        """
+        n, m = self.game.size
+        parts = ['\x1b[{};{}H{}'.format(i + 3, 2 * j + 3, self.cell_text((i, j)))
+                 for i, j in sorted(self.changed)]
+        parts.append('\x1b[{};1H\x1b[J'.format(n + 4))
+        return ''.join(parts)
 
     def show(self, msg):
         print('message:', msg)
@@ -75,6 +206,7 @@ class Client:
     def update(self, data):
         for pos, x in data:
             self.field[pos] = x
+            self.changed.add(pos)
 
 if __name__ == '__main__':
     game = minesweep.MineSweep((4, 8), 4)
@@ -0,0 +1,246 @@
+/*
+ * The backtracking core of solver.Component in C, loaded by csolver.py.
+ *
+ *     cc -O2 -shared -fPIC -o libcsolver.so csolver.c
+ *
+ * A component comes flat: constraint k holds the slots
+ * consIdx[consOff[k]..consOff[k+1]) (ascending) and needs count[k] mines
+ * among them, slot i is in the constraints watchIdx[watchOff[i]..watchOff[i+1]).
+ * The search visits the same nodes in the same order as the Python one
+ * (same propagation fixpoints, same pivot, mine branch first), so it finds
+ * the same solutions in the same order and spends the same budget.
+ */
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#define CLOCK_EVERY 64
+
+typedef struct {
+    int n, k;
+    const int *consOff, *consIdx, *count;
+    const int *watchOff, *watchIdx;
+    int8_t *val;
+    int *minesIn, *freeIn;
+    int *trail, trailLen;
+    int *queue, queueLen;
+    char *queued;
+    int mines;
+    long long propagations, pivots;
+} State;
+
+static void assign(State *s, int i, int v)
+{
+    s->val[i] = (int8_t)v;
+    s->trail[s->trailLen++] = i;
+    s->mines += v;
+    for (int w = s->watchOff[i]; w < s->watchOff[i + 1]; w++) {
+        int c = s->watchIdx[w];
+        s->freeIn[c]--;
+        s->minesIn[c] += v;
+    }
+}
+
+static void undo_to(State *s, int trailLen)
+{
+    while (s->trailLen > trailLen) {
+        int i = s->trail[--s->trailLen];
+        int v = s->val[i];
+        s->val[i] = -1;
+        s->mines -= v;
+        for (int w = s->watchOff[i]; w < s->watchOff[i + 1]; w++) {
+            int c = s->watchIdx[w];
+            s->freeIn[c]++;
+            s->minesIn[c] -= v;
+        }
+    }
+}
+
+static void push(State *s, int c)
+{
+    if (!s->queued[c]) {
+        s->queued[c] = 1;
+        s->queue[s->queueLen++] = c;
+    }
+}
+
+static void push_watch(State *s, int i)
+{
+    for (int w = s->watchOff[i]; w < s->watchOff[i + 1]; w++)
+        push(s, s->watchIdx[w]);
+}
+
+/* Run the queued constraints to a fixpoint, return 0 on a conflict. */
+static int propagate(State *s)
+{
+    s->propagations++;
+    while (s->queueLen) {
+        int c = s->queue[--s->queueLen];
+        s->queued[c] = 0;
+        int need = s->count[c] - s->minesIn[c];
+        int freeCount = s->freeIn[c];
+        if (need < 0 || need > freeCount) {
+            while (s->queueLen)
+                s->queued[s->queue[--s->queueLen]] = 0;
+            return 0;
+        }
+        if (!freeCount || (0 < need && need < freeCount))
+            continue;
+        int v = need ? 1 : 0;
+        for (int q = s->consOff[c]; q < s->consOff[c + 1]; q++) {
+            int i = s->consIdx[q];
+            if (s->val[i] < 0) {
+                assign(s, i, v);
+                push_watch(s, i);
+            }
+        }
+    }
+    return 1;
+}
+
+/* The lowest free slot of the constraint with the fewest ways left. */
+static int choose(State *s)
+{
+    int best = -1, bestKey = 0, bestFree = 0;
+    s->pivots++;
+    for (int c = 0; c < s->k; c++) {
+        int freeCount = s->freeIn[c];
+        if (!freeCount)
+            continue;
+        int need = s->count[c] - s->minesIn[c];
+        int key = need < freeCount - need ? need : freeCount - need;
+        if (best < 0 || key < bestKey || (key == bestKey && freeCount < bestFree)) {
+            best = c;
+            bestKey = key;
+            bestFree = freeCount;
+        }
+    }
+    for (int q = s->consOff[best]; q < s->consOff[best + 1]; q++)
+        if (s->val[s->consIdx[q]] < 0)
+            return s->consIdx[q];
+    return -1;
+}
+
+static double now(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+/*
+ * Enumerate the solutions extending val (-1 for a free slot) with at most
+ * maxMines mines (-1 for no limit), stop after limit of them (-1 for all).
+ * Solution j is copied to solutions + j*n if solutions is not NULL;
+ * counts[m] and bitCounts[m*n+i] count the solutions by mines, as
+ * Component.count, if they are not NULL. nodeLimit (-1 for none) and
+ * seconds (negative for none) are the budget, *nodes gets the nodes spent.
+ * stats gets the counters of solver.Component for instrument: the
+ * propagations, the pivots chosen and the deepest branching of a node.
+ * Return how many solutions were found, -1 if the budget ran out, -2 if
+ * out of memory.
+ */
+long long cs_search(int n, int k, const int *consOff, const int *consIdx, const int *count,
+                    const int *watchOff, const int *watchIdx, int8_t *val, int maxMines,
+                    long long limit, int8_t *solutions, uint64_t *counts, uint64_t *bitCounts,
+                    long long nodeLimit, double seconds, long long *nodes,
+                    long long *stats)
+{
+    State s;
+    s.n = n; s.k = k;
+    s.consOff = consOff; s.consIdx = consIdx; s.count = count;
+    s.watchOff = watchOff; s.watchIdx = watchIdx;
+    s.val = val;
+    s.minesIn = calloc(k + 1, sizeof(int));
+    s.freeIn = calloc(k + 1, sizeof(int));
+    s.trail = malloc((n + 1) * sizeof(int));
+    s.queue = malloc((k + 1) * sizeof(int));
+    s.queued = calloc(k + 1, 1);
+    /* a frame is a branching: the trail length before it and its slot */
+    int *frameTrail = malloc((n + 1) * sizeof(int));
+    int *frameSlot = malloc((n + 1) * sizeof(int));
+    int8_t *initial = malloc(n + 1);
+    long long found = 0, spent = 0, maxDepth = 0;
+    s.propagations = 0;
+    s.pivots = 0;
+    if (!s.minesIn || !s.freeIn || !s.trail || !s.queue || !s.queued ||
+            !frameTrail || !frameSlot || !initial) {
+        found = -2;
+        goto done;
+    }
+    memcpy(initial, val, n);
+    s.trailLen = 0;
+    s.queueLen = 0;
+    s.mines = 0;
+    for (int c = 0; c < k; c++) {
+        s.freeIn[c] = consOff[c + 1] - consOff[c];
+        push(&s, c);
+    }
+    for (int i = 0; i < n; i++) {
+        val[i] = -1;
+        if (initial[i] >= 0)
+            assign(&s, i, initial[i]);
+    }
+    double deadline = seconds >= 0 ? now() + seconds : 0;
+    int frames = 0;
+    int ok = propagate(&s);
+    for (;;) {
+        if (ok) {
+            spent++;
+            if ((nodeLimit >= 0 && spent > nodeLimit) ||
+                    (seconds >= 0 && spent % CLOCK_EVERY == 0 && now() > deadline)) {
+                found = -1;
+                break;
+            }
+            /* the frames open are the branchings that led here */
+            if (frames > maxDepth)
+                maxDepth = frames;
+            if (maxMines < 0 || s.mines <= maxMines) {
+                if (s.trailLen == n) {
+                    if (solutions)
+                        memcpy(solutions + found * n, val, n);
+                    if (counts) {
+                        counts[s.mines]++;
+                        if (bitCounts)
+                            for (int i = 0; i < n; i++)
+                                bitCounts[(size_t)s.mines * n + i] += val[i];
+                    }
+                    found++;
+                    if (limit >= 0 && found >= limit)
+                        break;
+                } else {
+                    int i = choose(&s);
+                    frameTrail[frames] = s.trailLen;
+                    frameSlot[frames] = i;
+                    frames++;
+                    assign(&s, i, 1);
+                    push_watch(&s, i);
+                    ok = propagate(&s);
+                    continue;
+                }
+            }
+        }
+        /* backtrack to the last branching still on its mine branch */
+        while (frames && val[frameSlot[frames - 1]] == 0) {
+            frames--;
+        }
+        if (!frames)
+            break;
+        int i = frameSlot[frames - 1];
+        undo_to(&s, frameTrail[frames - 1]);
+        assign(&s, i, 0);
+        push_watch(&s, i);
+        ok = propagate(&s);
+    }
+    undo_to(&s, 0);
+    memcpy(val, initial, n);
+done:
+    *nodes = spent;
+    stats[0] = s.propagations;
+    stats[1] = s.pivots;
+    stats[2] = maxDepth;
+    free(s.minesIn); free(s.freeIn); free(s.trail); free(s.queue); free(s.queued);
+    free(frameTrail); free(frameSlot); free(initial);
+    return found;
+}
@@ -0,0 +1,167 @@
+"""
+The C backend of the solver search, see csolver.c. Build it with
+
+    cc -O2 -shared -fPIC -o libcsolver.so csolver.c
+
+next to this file; if libcsolver.so is not there (or does not load) the
+solver keeps its pure Python search, see solver.use_backend().
+
+A component is handed over flat: the constraints as arrays of slot
+indices, counts and watch lists, made once per Component by encode_flat().
+The C search visits the same nodes in the same order as Component.search,
+so solve, count and first give the same results, spend the same budget and
+add the same propagate, pivot and depth counts to instrument.counters.
+"""
+import ctypes
+import os
+
+import instrument
+import solver
+
+LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libcsolver.so')
+# count() keeps per bit counts for every mine total in C, a component that
+#  would need more than that many of them is counted in Python
+MAX_BIT_COUNTS = 1 << 22
+# a translate() table of the bytes 0 and 1 of a solution to binary digits
+DIGITS = b'01' + bytes(254)
+
+IntArray = ctypes.POINTER(ctypes.c_int)
+ByteArray = ctypes.POINTER(ctypes.c_int8)
+lib = None
+loadError = None
+
+def load():
+    """
+    Load the library if not done yet, return whether it is there.
+    """
+    global lib, loadError
+    if lib is None and loadError is None:
+        try:
+            lib = ctypes.CDLL(LIBRARY)
+        except OSError as e:
+            loadError = e
+            return False
+        lib.cs_search.restype = ctypes.c_longlong
+        lib.cs_search.argtypes = [
+            ctypes.c_int, ctypes.c_int, IntArray, IntArray, IntArray, IntArray, IntArray,
+            ByteArray, ctypes.c_int, ctypes.c_longlong, ByteArray,
+            ctypes.POINTER(ctypes.c_uint64), ctypes.POINTER(ctypes.c_uint64),
+            ctypes.c_longlong, ctypes.c_double, ctypes.POINTER(ctypes.c_longlong),
+            ctypes.POINTER(ctypes.c_longlong)]
+    return lib is not None
+
+def int_array(values):
+    return (ctypes.c_int * max(1, len(values)))(*values)
+
+class FlatComponent:
+    """
+    The arrays of a component for cs_search.
+    members:
+
+    n, k: how many slots and constraints.
+    consOff, consIdx, count: constraint c is count[c] mines among the slots
+        consIdx[consOff[c]:consOff[c+1]], in ascending order.
+    watchOff, watchIdx: slot i is in the constraints
+        watchIdx[watchOff[i]:watchOff[i+1]].
+    """
+    def __init__(self, component):
+        self.n = len(component.keys)
+        self.k = len(component.constraints)
+        consOff, consIdx, count = [0], [], []
+        for mask, c in component.constraints:
+            consIdx.extend(solver.bits(mask))
+            consOff.append(len(consIdx))
+            count.append(c)
+        watchOff, watchIdx = [0], []
+        for watch in component.watch:
+            watchIdx.extend(watch)
+            watchOff.append(len(watchIdx))
+        self.consOff = int_array(consOff)
+        self.consIdx = int_array(consIdx)
+        self.count = int_array(count)
+        self.watchOff = int_array(watchOff)
+        self.watchIdx = int_array(watchIdx)
+
+def encode_flat(component):
+    """
+    Return the FlatComponent of component, made on first use.
+    """
+    flat = component.flat
+    if flat is None:
+        flat = component.flat = FlatComponent(component)
+    return flat
+
+def search(component, mines, safes, maxMines, budget, limit=-1, keep=False, counting=False):
+    """
+    Run cs_search on component from the (mines, safes) assignment. Return
+    (found, solutions, counts, bitCounts): solutions is the list of the
+    mines masks if keep, counts and bitCounts the ctypes arrays if counting.
+    Spend the nodes on budget, raise BudgetExceeded if it runs out.
+    """
+    flat = encode_flat(component)
+    n = flat.n
+    val = [-1] * n
+    for i in solver.bits(mines):
+        val[i] = 1
+    for i in solver.bits(safes):
+        val[i] = 0
+    val = (ctypes.c_int8 * max(1, n))(*val)
+    solutions = None
+    if keep:
+        solutions = (ctypes.c_int8 * max(1, n * limit))()
+    counts = bitCounts = None
+    if counting:
+        counts = (ctypes.c_uint64 * (n + 1))()
+        bitCounts = (ctypes.c_uint64 * max(1, (n + 1) * n))()
+    nodeLimit, seconds = -1, -1.0
+    if budget is not None:
+        if budget.nodes is not None:
+            nodeLimit = max(0, budget.nodes)
+        remaining = budget.remaining_seconds()
+        if remaining is not None:
+            seconds = remaining
+    nodes = ctypes.c_longlong()
+    # propagations, pivots, max depth
+    stats = (ctypes.c_longlong * 3)()
+    found = lib.cs_search(n, flat.k, flat.consOff, flat.consIdx, flat.count,
+                          flat.watchOff, flat.watchIdx, val,
+                          -1 if maxMines is None else maxMines, limit,
+                          solutions, counts, bitCounts, nodeLimit, seconds, ctypes.byref(nodes),
+                          stats)
+    if instrument.ENABLED:
+        counters = instrument.counters
+        counters['search'] += nodes.value
+        counters['propagate'] += stats[0]
+        counters['pivot'] += stats[1]
+        instrument.note_depth(stats[2])
+    if budget is not None and budget.nodes is not None:
+        budget.nodes -= nodes.value
+    if found == -2:
+        raise MemoryError("cs_search")
+    if found < 0:
+        budget.fail()
+    masks = None
+    if keep:
+        raw = bytes(solutions)
+        masks = [int(b'0' + raw[j * n:(j + 1) * n][::-1].translate(DIGITS), 2) for j in range(found)]
+    return found, masks, counts, bitCounts
+
+def solve(component, mines=0, safes=0, maxMines=None, budget=None):
+    found, masks, counts, bitCounts = search(component, mines, safes, maxMines, budget, 1, keep=True)
+    return masks[0] if found else None
+
+def first(component, limit, mines=0, safes=0, maxMines=None, budget=None):
+    if limit <= 0:
+        return []
+    found, masks, counts, bitCounts = search(component, mines, safes, maxMines, budget, limit, keep=True)
+    return masks
+
+def count(component, mines=0, safes=0, maxMines=None, budget=None):
+    found, masks, counts, bitCounts = search(component, mines, safes, maxMines, budget, counting=True)
+    n = len(component.keys)
+    totals = {m: c for m, c in enumerate(counts) if c}
+    return totals, {m: bitCounts[m * n:(m + 1) * n] for m in totals}
+
+def can_count(component):
+    n = len(component.keys)
+    return (n + 1) * n <= MAX_BIT_COUNTS
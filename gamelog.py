@@ -0,0 +1,462 @@
+"""
+A streaming binary log of a game, and its replay.
+
+While a client plays, a GameWriter set as its log appends a record for
+every move and flushes it, so the log of a game that crashed or was killed
+is good up to its last move. A log file is
+
+    magic 'MSLG', version u16, reserved u16, then records of
+    type u8, length u32 and length bytes of payload:
+
+    MAP: the map file of the game, see mapfile.py.
+    START: the engine name (a key of ENGINES) and the client settings (see
+        START), then the random state the client started from (see RANDOM).
+    MOVE: move u32, phase u8, ns u64, command length u16, the command in
+        utf-8, then an update list: count u32 (NO_UPDATE if the game ignored
+        the move), count x (i i32, j i32) and count value bytes.
+    SNAPSHOT: move u32, then the zlib compressed state of an AIClient after
+        that move: the random state, step, guessCount and budgetOuts u32,
+        the uncovered positions as an update list, then as position lists
+        (count u32, count x (i i32, j i32)) the marks, the nodes it reasons
+        on, its pending nodes and its dirty slots, and at last guess count
+        u32 and the guessProbs as f64.
+    END: the state the game ended in, in utf-8.
+
+A value is a count 0-8 or MINE. phase is an index in PHASES, ns how long
+the client took to find the move (instrument.Recorder.lastNs), 0 if it
+does not say. All integers are little endian.
+
+A GameLog replays the map with a QuietAIClient and checks that it makes
+the same moves with the same results, and has the state of every snapshot.
+seek() rebuilds the client from the last snapshot before a move, so a slow
+or wrong move can be reproduced and profiled on its own. A client takes
+the slots and nodes it decides on by position (ai.by_pos), so one rebuilt
+from what it saw plays on as the one that wrote the log, and writing the
+log does not change the game.
+
+Replays are exact when the moves have no budget. A search answered by the
+solver cache spends no budget, so the writer and the replay each count
+through a fresh cache: under a nodes budget the replay from the start is
+exact, but a client rebuilt from a snapshot does not have the solver
+records the writer had kept, and may run out of budget on a move the
+writer did not. A move under a seconds budget may come out differently
+whenever the machine is busier.
+
+    python3 ai.py -g                            # play, writing last_game.mslog
+    python3 gamelog.py show last_game.mslog     # list the moves
+    python3 gamelog.py replay last_game.mslog   # check the game plays the same
+    python3 gamelog.py replay last_game.mslog --at 120 --profile  # profile move 121
+"""
+import argparse
+import array
+import collections
+import cProfile
+import pstats
+import random
+import struct
+import sys
+import zlib
+
+import ai
+import arraysweep
+import mapfile
+import minesweep
+import solver
+
+MAGIC = b'MSLG'
+VERSION = 2
+HEADER = struct.Struct('<4sHH')
+RECORD = struct.Struct('<BI')
+# workers u16, labelRegions u8, moveSeconds f64 (negative for none),
+#  moveNodes i64 (-1 for none), engine name length u16
+START = struct.Struct('<HBdqH')
+MOVE = struct.Struct('<IBQH')
+COUNT = struct.Struct('<I')
+SNAPSHOT_MOVE = struct.Struct('<I')
+# random.getstate(): version u8, the 625 words of the Mersenne Twister,
+#  whether a gauss value is kept u8, that value f64
+RANDOM = struct.Struct('<B625IBd')
+# step, guessCount, budgetOuts
+COUNTERS = struct.Struct('<III')
+
+MAP, START_RECORD, MOVE_RECORD, SNAPSHOT, END = range(1, 6)
+# the engines a log can be played on, by the name the START record gives;
+#  a log naming another one is rejected, it does not pick the code it runs
+ENGINES = {
+    'minesweep.MineSweep': minesweep.MineSweep,
+    'arraysweep.ArrayMineSweep': arraysweep.ArrayMineSweep,
+    }
+NO_UPDATE = 0xffffffff
+MINE = 9
+PHASES = (None, 'first', 'queued') + tuple(dict.fromkeys(ai.PHASES)) + ('guess',)
+# moves between two snapshots
+SNAPSHOT_EVERY = 50
+
+class LogFormatError(Exception):
+    pass
+
+class ReplayMismatch(Exception):
+    pass
+
+def encode_random(state):
+    version, words, gauss = state
+    return RANDOM.pack(version, *words, gauss is not None, gauss or 0.0)
+
+def decode_random(buffer, offset=0):
+    values = RANDOM.unpack_from(buffer, offset)
+    return values[0], values[1:-2], values[-1] if values[-2] else None
+
+def encode_coords(positions):
+    coords = array.array('i')
+    for i, j in positions:
+        coords.append(i)
+        coords.append(j)
+    if sys.byteorder != 'little':
+        coords.byteswap()
+    return coords.tobytes()
+
+def decode_coords(buffer, offset, count):
+    coords = array.array('i')
+    coords.frombytes(buffer[offset:offset + 8 * count])
+    if sys.byteorder != 'little':
+        coords.byteswap()
+    return [(coords[2 * k], coords[2 * k + 1]) for k in range(count)]
+
+def encode_positions(positions):
+    return COUNT.pack(len(positions)) + encode_coords(positions)
+
+def decode_positions(buffer, offset):
+    """
+    Return the position list at offset and the offset after it.
+    """
+    count, = COUNT.unpack_from(buffer, offset)
+    offset += COUNT.size
+    return decode_coords(buffer, offset, count), offset + 8 * count
+
+def encode_updated(updated):
+    if updated is None:
+        return COUNT.pack(NO_UPDATE)
+    values = bytes(MINE if val == ai.AIClient.FLD_MINE else val for pos, val in updated)
+    return COUNT.pack(len(updated)) + encode_coords(pos for pos, val in updated) + values
+
+def decode_updated(buffer, offset):
+    """
+    Return the update list at offset and the offset after it.
+    """
+    count, = COUNT.unpack_from(buffer, offset)
+    offset += COUNT.size
+    if count == NO_UPDATE:
+        return None, offset
+    positions = decode_coords(buffer, offset, count)
+    values = buffer[offset + 8 * count:offset + 9 * count]
+    updated = [(pos, ai.AIClient.FLD_MINE if val == MINE else val)
+               for pos, val in zip(positions, values)]
+    return updated, offset + 9 * count
+
+def encode_snapshot(client):
+    """
+    The state of a running AIClient between two moves, see SNAPSHOT. It
+    holds what the client saw and what it still has to go through; the
+    Node and Slot graph is built again from it by restore(). The client is
+    only read.
+    """
+    field = client.field
+    revealed = sorted((pos, val) for pos, val in field.items()
+                      if val not in (client.FLD_UNKNOWN, client.FLD_MARK))
+    marks = sorted(pos for pos, val in field.items() if val == client.FLD_MARK)
+    availNodes = client.availNodes
+    probs = array.array('d', client.guessProbs)
+    if sys.byteorder != 'little':
+        probs.byteswap()
+    return b''.join((
+        encode_random(random.getstate()),
+        COUNTERS.pack(client.step, client.guessCount, client.budgetOuts),
+        encode_updated(revealed),
+        encode_positions(marks),
+        encode_positions(sorted(node.pos for node in availNodes)),
+        # in the order infer() takes them
+        encode_positions([node.pos for node in client.pending if node in availNodes]),
+        encode_positions(sorted(client.dirtySlots)),
+        COUNT.pack(len(probs)),
+        probs.tobytes(),
+        ))
+
+def restore(client, data):
+    """
+    Bring client, new on a game just started, to the state encoded in data
+    by encode_snapshot(), and set the random state.
+    """
+    offset = RANDOM.size
+    client.step, client.guessCount, client.budgetOuts = COUNTERS.unpack_from(data, offset)
+    offset += COUNTERS.size
+    revealed, offset = decode_updated(data, offset)
+    marks, offset = decode_positions(data, offset)
+    availNodes, offset = decode_positions(data, offset)
+    pending, offset = decode_positions(data, offset)
+    dirtySlots, offset = decode_positions(data, offset)
+    count, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    probs = array.array('d')
+    probs.frombytes(data[offset:offset + 8 * count])
+    if sys.byteorder != 'little':
+        probs.byteswap()
+    game = client.game
+    game.uncover_many([pos for pos, val in revealed])
+    game.get_updated()
+    client.update(revealed)
+    searchField = client.searchField
+    for pos in marks:
+        client.mark_mine(searchField[pos])
+    client.mark_many(marks)
+    client.marks.clear()
+    client.availNodes = {searchField[pos] for pos in availNodes}
+    client.pending = collections.deque(searchField[pos] for pos in pending)
+    client.pendingSet = set(client.pending)
+    client.dirtySlots = set(dirtySlots)
+    client.componentList = None
+    client.guessProbs = probs.tolist()
+    random.setstate(decode_random(data))
+
+class GameWriter:
+    """
+    The log of a client, set as its log before play().
+    members:
+
+    outfile
+    snapshotEvery: write a snapshot after every that many moves, 0 for
+        none.
+    """
+    def __init__(self, filename, snapshotEvery=SNAPSHOT_EVERY):
+        self.outfile = open(filename, 'wb')
+        self.snapshotEvery = snapshotEvery
+        self.outfile.write(HEADER.pack(MAGIC, VERSION, 0))
+
+    def write_record(self, kind, payload):
+        self.outfile.write(RECORD.pack(kind, len(payload)))
+        self.outfile.write(payload)
+
+    def begin(self, client):
+        game = client.game
+        engine = next((name for name, cls in ENGINES.items() if type(game) is cls), None)
+        if engine is None:
+            raise LogFormatError("a {} can not be logged".format(type(game).__name__))
+        engine = engine.encode()
+        self.write_record(MAP, game.to_map())
+        moveSeconds = getattr(client, 'moveSeconds', None)
+        moveNodes = getattr(client, 'moveNodes', None)
+        self.write_record(START_RECORD, START.pack(
+            getattr(client, 'workers', 0), getattr(game, 'labelRegions', False),
+            -1 if moveSeconds is None else moveSeconds, -1 if moveNodes is None else moveNodes,
+            len(engine)) + engine + encode_random(random.getstate()))
+        if isinstance(client, ai.AIClient):
+            # as the replay does, so a budget runs out on the same moves
+            client.cache = solver.ComponentCache()
+        self.outfile.flush()
+
+    def write_move(self, client, input, updated):
+        phase = getattr(client, 'phase', None)
+        recorder = getattr(client, 'recorder', None)
+        ns = recorder.lastNs if recorder is not None and recorder.lastNs else 0
+        command = input.encode()
+        self.write_record(MOVE_RECORD, MOVE.pack(
+            client.moves, PHASES.index(phase) if phase in PHASES else 0, ns, len(command))
+            + command + encode_updated(updated))
+        if self.snapshotEvery and client.moves % self.snapshotEvery == 0 \
+                and client.game.get_state() == client.STATE_RUNNING \
+                and isinstance(client, ai.AIClient):
+            self.write_snapshot(client)
+        self.outfile.flush()
+
+    def write_snapshot(self, client):
+        self.write_record(SNAPSHOT, SNAPSHOT_MOVE.pack(client.moves)
+                          + zlib.compress(encode_snapshot(client)))
+
+    def end(self, client):
+        self.write_record(END, client.game.get_state().encode())
+        self.outfile.flush()
+
+    def close(self):
+        self.outfile.close()
+
+def read_records(buffer):
+    """
+    Yield the (type, payload) records of a log. A record cut short at the
+    end, by a game that did not finish writing it, is left out.
+    """
+    if len(buffer) < HEADER.size:
+        raise LogFormatError("log is too short")
+    magic, version, reserved = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise LogFormatError("not a game log")
+    if version != VERSION:
+        raise LogFormatError("unsupported log version {}".format(version))
+    offset = HEADER.size
+    while offset + RECORD.size <= len(buffer):
+        kind, length = RECORD.unpack_from(buffer, offset)
+        offset += RECORD.size
+        if offset + length > len(buffer):
+            return
+        yield kind, buffer[offset:offset + length]
+        offset += length
+
+class GameLog:
+    """
+    A log read back.
+    members:
+
+    map: the map file bytes of the game.
+    engine: the name of the game class, a key of ENGINES.
+    workers, labelRegions, moveSeconds, moveNodes: the settings the game
+        was played with.
+    randomState: the random.getstate() the client started from.
+    moves: a list of dicts, move, phase, ns, command, updated (as
+        get_updated() gave it).
+    snapshots: a dict of move to its snapshot, as encode_snapshot() gave
+        it.
+    state: the state the game ended in, None if the log stops before.
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as infile:
+            buffer = infile.read()
+        self.map = None
+        self.moves = []
+        self.snapshots = {}
+        self.state = None
+        for kind, payload in read_records(buffer):
+            if kind == MAP:
+                self.map = payload
+            elif kind == START_RECORD:
+                self.workers, labelRegions, moveSeconds, moveNodes, length = START.unpack_from(payload)
+                self.labelRegions = bool(labelRegions)
+                self.moveSeconds = None if moveSeconds < 0 else moveSeconds
+                self.moveNodes = None if moveNodes < 0 else moveNodes
+                self.engine = payload[START.size:START.size + length].decode()
+                if self.engine not in ENGINES:
+                    raise LogFormatError("unknown engine {!r}".format(self.engine))
+                self.randomState = decode_random(payload, START.size + length)
+            elif kind == MOVE_RECORD:
+                move, phase, ns, length = MOVE.unpack_from(payload)
+                offset = MOVE.size + length
+                self.moves.append({
+                    'move': move,
+                    'phase': PHASES[phase],
+                    'ns': ns,
+                    'command': payload[MOVE.size:offset].decode(),
+                    'updated': decode_updated(payload, offset)[0],
+                    })
+            elif kind == SNAPSHOT:
+                move, = SNAPSHOT_MOVE.unpack_from(payload)
+                self.snapshots[move] = zlib.decompress(payload[SNAPSHOT_MOVE.size:])
+            elif kind == END:
+                self.state = payload.decode()
+        if self.map is None:
+            raise LogFormatError("log has no map")
+
+    def new_game(self):
+        game = ENGINES[self.engine].from_map(mapfile.MapView(self.map))
+        game.labelRegions = self.labelRegions
+        return game
+
+    def seek(self, move=0):
+        """
+        Return a QuietAIClient that has played the first move moves, from
+        the last snapshot at or before move. The moves played are checked
+        against the log, and so are the ones it plays next.
+        """
+        start = max((m for m in self.snapshots if m <= move), default=0)
+        client = ai.QuietAIClient(self.new_game(), self.workers)
+        client.moveSeconds, client.moveNodes = self.moveSeconds, self.moveNodes
+        client.cache = solver.ComponentCache()
+        client.maxMoves = move
+        if start:
+            game = client.game
+            game.start()
+            client.field = game.new_field() if hasattr(game, 'new_field') else {}
+            restore(client, self.snapshots[start])
+            client.moves = start
+            client.log = Checker(self)
+            client.resume()
+        else:
+            random.setstate(self.randomState)
+            client.log = Checker(self)
+            client.play()
+        return client
+
+    def replay(self, client=None):
+        """
+        Play the game to the end of the log, from the start or from a
+        client given by seek(), checking every move. Return the client.
+        """
+        if client is None:
+            client = self.seek()
+        client.maxMoves = len(self.moves)
+        client.resume()
+        return client
+
+class Checker:
+    """
+    The log of a replayed client: it raises ReplayMismatch when a move or
+    its result differs from the logged one.
+    """
+    def __init__(self, log):
+        self.log = log
+
+    def begin(self, client):
+        pass
+
+    def write_move(self, client, input, updated):
+        moves = self.log.moves
+        if client.moves > len(moves):
+            raise ReplayMismatch("move {} is past the end of the log".format(client.moves))
+        expected = moves[client.moves - 1]
+        phase = getattr(client, 'phase', None)
+        for key, got in (('command', input), ('updated', updated), ('phase', phase)):
+            if got != expected[key]:
+                raise ReplayMismatch("move {}: {} is {!r}, the log has {!r}".format(
+                    client.moves, key, got, expected[key]))
+        if client.moves in self.log.snapshots \
+                and encode_snapshot(client) != self.log.snapshots[client.moves]:
+            raise ReplayMismatch("move {}: the state differs from the snapshot".format(client.moves))
+
+    def end(self, client):
+        state = client.game.get_state()
+        if state != client.STATE_RUNNING and self.log.state is not None and state != self.log.state:
+            raise ReplayMismatch("the game ends {}, the log has {}".format(state, self.log.state))
+
+def show(log):
+    for move in log.moves:
+        updated = move['updated']
+        command = move['command']
+        print('{:5d} {:16s} {:9.3f} ms {:>6s} {}'.format(
+            move['move'], move['phase'] or '-', move['ns'] / 1e6,
+            '-' if updated is None else str(len(updated)),
+            command if len(command) <= 60 else command[:57] + '...'))
+    print('{} moves, {} snapshots, {}'.format(len(log.moves), len(log.snapshots),
+                                             log.state or 'not finished'))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="show or replay a game log")
+    parser.add_argument('action', choices=('show', 'replay'))
+    parser.add_argument('filename')
+    parser.add_argument('--at', type=int, default=0,
+                        help='replay: start after that many moves, from a snapshot')
+    parser.add_argument('--profile', action='store_true',
+                        help='replay: profile the move after --at, not the rest of the game')
+    args = parser.parse_args(argv)
+    log = GameLog(args.filename)
+    if args.action == 'show':
+        show(log)
+        return 0
+    client = log.seek(args.at)
+    if args.profile:
+        client.maxMoves = args.at + 1
+        profile = cProfile.Profile()
+        profile.runcall(client.resume)
+        pstats.Stats(profile).sort_stats('cumulative').print_stats(25)
+    else:
+        log.replay(client)
+    print('replayed to move {} of {}, the same moves'.format(client.moves, len(log.moves)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,142 @@
+"""
+Instrumentation for the AI: phase timers, solver counters and a record per
+move.
+
+Every AIClient has a Recorder, which times the solver phases with
+perf_counter_ns and keeps a record of every sampleEvery-th move: which
+phase produced it, how many positions it uncovers and marks, and how long
+it took. That costs a few clock reads per move and is always on.
+
+The counters in the hot solver loops (search nodes, propagations, pivot
+choices, backtracking depth, Slot.apply/undo) are only kept while ENABLED
+is set, see enable(), so when off they cost one flag test. Work done on a
+solver process pool is not counted.
+
+A recorder exports as JSON lines (write_jsonl) or as a pstats file
+(write_pstats) for pstats, snakeviz and the other cProfile tools.
+"""
+import collections
+import json
+import marshal
+import time
+
+ENABLED = 0
+
+# search: Component.search calls, that is nodes expanded
+# propagate: Component.propagate calls
+# pivot: Component.choose_bit calls
+# apply, undo: Slot.apply and Slot.undo calls
+# witness: satisfiability tests answered by a solution found before
+# depth: the deepest backtracking of the current move
+# max_depth: the deepest backtracking since the last reset
+counters = collections.Counter()
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = 1 if on else 0
+
+def reset():
+    counters.clear()
+
+def note_depth(depth):
+    if depth > counters['depth']:
+        counters['depth'] = depth
+        if depth > counters['max_depth']:
+            counters['max_depth'] = depth
+
+class Recorder:
+    """
+    members:
+
+    phases: a dict of phase name to the list of its call durations in ns.
+    moves: the sampled move records, a list of dicts.
+    sampleEvery: keep the record of one move out of that many, 0 for none.
+    moveCount: how many moves were seen, sampled or not.
+    lastNs: how long the last move took, sampled or not.
+    """
+    def __init__(self, sampleEvery=1):
+        self.phases = collections.defaultdict(list)
+        self.moves = []
+        self.sampleEvery = sampleEvery
+        self.moveCount = 0
+        self.moveStart = None
+        self.moveCounters = None
+        self.lastNs = None
+
+    def time(self, phase, method):
+        """
+        Call method, record how long it takes under phase and return what it
+        returns.
+        """
+        start = time.perf_counter_ns()
+        try:
+            return method()
+        finally:
+            self.phases[phase].append(time.perf_counter_ns() - start)
+
+    def last_ms(self, phase):
+        return self.phases[phase][-1] // 1000000
+
+    def begin_move(self):
+        self.moveStart = time.perf_counter_ns()
+        if ENABLED:
+            self.moveCounters = counters.copy()
+            counters['depth'] = 0
+
+    def end_move(self, step, phase, uncovers, marks):
+        """
+        Close the move begun by begin_move. phase is the phase that found
+        it, 'queued' if it was already known from an earlier phase.
+        """
+        self.moveCount += 1
+        self.lastNs = time.perf_counter_ns() - self.moveStart
+        if not self.sampleEvery or self.moveCount % self.sampleEvery:
+            return
+        record = {
+            'move': self.moveCount,
+            'step': step,
+            'phase': phase,
+            'uncover': uncovers,
+            'mark': marks,
+            'ns': self.lastNs,
+            }
+        if ENABLED and self.moveCounters is not None:
+            delta = counters - self.moveCounters
+            delta['depth'] = counters['depth']
+            del delta['max_depth']
+            record['counters'] = dict(delta)
+        self.moves.append(record)
+
+    def summary(self):
+        return {
+            'moves': self.moveCount,
+            'phases': {phase: {'calls': len(times), 'total_ns': sum(times)}
+                       for phase, times in self.phases.items()},
+            'counters': dict(counters) if ENABLED else None,
+            }
+
+    def write_jsonl(self, filename, **extra):
+        """
+        Append the move records to a JSON lines file, then one summary line.
+        extra is added to every line (a game seed for example).
+        """
+        with open(filename, 'a') as outfile:
+            for record in self.moves:
+                outfile.write(json.dumps(dict(record, **extra)) + '\n')
+            outfile.write(json.dumps(dict(self.summary(), type='summary', **extra)) + '\n')
+
+def write_pstats(filename, phases, functions):
+    """
+    Write phase timings as a pstats file, so they load with
+    pstats.Stats(filename). phases is a dict of phase name to durations in
+    ns, functions a dict of phase name to the function it is reported as.
+    """
+    stats = {}
+    for phase, times in phases.items():
+        code = functions[phase].__code__
+        total = sum(times) / 1e9
+        # (primitive calls, calls, own time, cumulative time, callers)
+        stats[code.co_filename, code.co_firstlineno, code.co_name] = \
+                len(times), len(times), total, total, {}
+    with open(filename, 'wb') as outfile:
+        marshal.dump(stats, outfile)
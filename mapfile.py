@@ -0,0 +1,198 @@
+"""
+A compact binary format for mine fields.
+
+A map file is a header followed by the packed mine bitmap:
+
+    magic 'MSWP', version u16, flags u16, width u32, height u32,
+    mineCount u32, seed u64, then ceil(width*height/8) bytes,
+    then i u32, j u32 of the first click if flags has FLAG_FIRST_CLICK
+
+Position (i, j) is bit i*height+j, least significant bit first. All
+integers are little endian. A corpus file holds many maps, each one
+zlib compressed:
+
+    magic 'MSWC', version u16, reserved u16, count u32,
+    count x (offset u64, length u32), then the compressed maps
+
+Files are read through mmap, a map is not copied until it is unpacked.
+"""
+import mmap
+import os
+import struct
+import zlib
+
+MAP_MAGIC = b'MSWP'
+CORPUS_MAGIC = b'MSWC'
+VERSION = 1
+FLAG_SEED = 1
+FLAG_FIRST_CLICK = 2
+
+HEADER = struct.Struct('<4sHHIIIQ')
+FIRST_CLICK = struct.Struct('<II')
+CORPUS_HEADER = struct.Struct('<4sHHI')
+CORPUS_ENTRY = struct.Struct('<QI')
+
+class MapFormatError(Exception):
+    pass
+
+def bitmap_size(size):
+    w, h = size
+    return (w * h + 7) // 8
+
+def pack_positions(size, positions):
+    """
+    Pack a collection of positions into a bitmap.
+    """
+    h = size[1]
+    bitmap = bytearray(bitmap_size(size))
+    for i, j in positions:
+        k = i * h + j
+        bitmap[k >> 3] |= 1 << (k & 7)
+    return bytes(bitmap)
+
+def encode(size, mineCount, seed, bitmap, firstClick=None):
+    """
+    Return the bytes of a map file.
+    """
+    w, h = size
+    flags = 0
+    if seed is not None:
+        flags |= FLAG_SEED
+    trailer = b''
+    if firstClick is not None:
+        flags |= FLAG_FIRST_CLICK
+        trailer = FIRST_CLICK.pack(*firstClick)
+    header = HEADER.pack(MAP_MAGIC, VERSION, flags, w, h, mineCount, seed or 0)
+    return header + bytes(bitmap) + trailer
+
+def open_mmap(filename):
+    with open(filename, 'rb') as infile:
+        return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+class MapView:
+    """
+    A read only view of one encoded map.
+    members:
+
+    size, mineCount
+    seed: None if the map was not generated from a seed.
+    firstClick: the position kept free of mines, or None.
+    bitmap: a memoryview of the packed mine bitmap, no copy is made.
+    """
+    def __init__(self, buffer):
+        if len(buffer) < HEADER.size:
+            raise MapFormatError("map is too short")
+        magic, version, flags, w, h, mineCount, seed = HEADER.unpack_from(buffer)
+        if magic != MAP_MAGIC:
+            raise MapFormatError("not a map file")
+        if version != VERSION:
+            raise MapFormatError("unsupported map version {}".format(version))
+        self.buffer = buffer
+        self.size = w, h
+        self.mineCount = mineCount
+        self.seed = seed if flags & FLAG_SEED else None
+        end = HEADER.size + bitmap_size(self.size)
+        if len(buffer) < end:
+            raise MapFormatError("map bitmap is truncated")
+        self.bitmap = memoryview(buffer)[HEADER.size:end]
+        self.firstClick = None
+        if flags & FLAG_FIRST_CLICK:
+            if len(buffer) < end + FIRST_CLICK.size:
+                raise MapFormatError("map first click is truncated")
+            self.firstClick = FIRST_CLICK.unpack_from(buffer, end)
+
+    @classmethod
+    def open(cls, filename):
+        return cls(open_mmap(filename))
+
+    def mine_positions(self):
+        """
+        Yield the positions of the mines.
+        """
+        h = self.size[1]
+        for b, byte in enumerate(self.bitmap):
+            while byte:
+                low = byte & -byte
+                k = b * 8 + low.bit_length() - 1
+                yield divmod(k, h)
+                byte ^= low
+
+def write_corpus(filename, maps):
+    """
+    Write an iterable of encoded maps (bytes) into a corpus file.
+    """
+    records = [zlib.compress(data) for data in maps]
+    offset = CORPUS_HEADER.size + CORPUS_ENTRY.size * len(records)
+    index = []
+    for record in records:
+        index.append(CORPUS_ENTRY.pack(offset, len(record)))
+        offset += len(record)
+    with open(filename, 'wb') as outfile:
+        outfile.write(CORPUS_HEADER.pack(CORPUS_MAGIC, VERSION, 0, len(records)))
+        outfile.write(b''.join(index))
+        for record in records:
+            outfile.write(record)
+
+class Corpus:
+    """
+    A corpus file opened through mmap. Maps are only decompressed when
+    they are read, corpus[k] is a MapView.
+    """
+    def __init__(self, filename):
+        self.buffer = open_mmap(filename)
+        magic, version, reserved, count = CORPUS_HEADER.unpack_from(self.buffer)
+        if magic != CORPUS_MAGIC:
+            raise MapFormatError("not a corpus file")
+        if version != VERSION:
+            raise MapFormatError("unsupported corpus version {}".format(version))
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, k):
+        if not 0 <= k < self.count:
+            raise IndexError(k)
+        offset, length = CORPUS_ENTRY.unpack_from(
+                self.buffer, CORPUS_HEADER.size + CORPUS_ENTRY.size * k)
+        return MapView(zlib.decompress(self.buffer[offset:offset+length]))
+
+    def __iter__(self):
+        for k in range(self.count):
+            yield self[k]
+
+def check_round_trip(engine, data, directory):
+    """
+    Load the map data with engine (a game class with load and save), save
+    it, load it again, and the same once started; raise MapFormatError if
+    a map does not come back as it was.
+    """
+    first = os.path.join(directory, 'first')
+    second = os.path.join(directory, 'second')
+    with open(first, 'wb') as outfile:
+        outfile.write(data)
+    for started in (False, True):
+        game = engine.load(first)
+        if started:
+            game.start()
+        game.save(second)
+        again = engine.load(second).to_map()
+        if again != data:
+            raise MapFormatError("{} changes the map through load and save{}".format(
+                engine.__name__, ' once started' if started else ''))
+
+if __name__ == '__main__':
+    # check that every engine keeps its maps through load and save
+    import tempfile
+    import arraysweep
+    import minesweep
+    maps = []
+    for size, mineCount, safe in (((9, 9), 10, (4, 4)), ((16, 30), 99, None), ((3, 5), 15, None)):
+        game = minesweep.MineSweep(size, mineCount)
+        game.gen_mines(7, safe)
+        maps.append(game.to_map())
+    with tempfile.TemporaryDirectory() as directory:
+        for engine in (minesweep.MineSweep, arraysweep.ArrayMineSweep):
+            for data in maps:
+                check_round_trip(engine, data, directory)
+    print('ok')
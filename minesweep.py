@@ -1,6 +1,6 @@
 import random
 import itertools
-import pickle
+import mapfile
 
 def shuffle(lst):
     n = len(lst)
@@ -10,36 +10,128 @@ def shuffle(lst):
                 if (1+i+j+k)*(7+i-j+k) % 3:
                     lst[i], lst[j] = lst[j], lst[i]
 
+def safe_zone(size, mineCount, safe):
+    """
+    Return the flat indices (i*h+j) to keep free of mines so that a first
+    click at safe opens a region: safe and its neighbours, or only safe if
+    the field is too crowded for that.
+    """
+    if safe is None:
+        return set()
+    w, h = size
+    i, j = safe
+    zone = {i1 * h + j1 for i1 in range(max(i - 1, 0), min(i + 2, w))
+            for j1 in range(max(j - 1, 0), min(j + 2, h))}
+    if mineCount > w * h - len(zone):
+        zone = {i * h + j}
+    if mineCount > w * h - len(zone):
+        raise Exception("field with size {}x{} can not hold {} mines besides {}".format(w, h, mineCount, safe))
+    return zone
+
+def parse_size(text):
+    """
+    Parse a WxH size of the command line into (w, h).
+    """
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+def uncover_many(game, positions):
+    """
+    Uncover a batch of positions on game as one operation, the uncover_many
+    of the engines: get_updated then returns the merged updates. The whole
+    batch is ignored if the game is not running or a position is outside
+    the field. Positions already uncovered, also by an earlier one of the
+    batch, are skipped, and the batch stops at a mine. The update of the
+    mine replaces the others if game.lossRevealsField, else it is added.
+    """
+    if game.state != 'running' or any(not game.in_field(pos) for pos in positions):
+        game.updated = None
+        return
+    merged = []
+    for pos in positions:
+        game.uncover(pos)
+        updated = game.get_updated()
+        if game.state == 'lost' and game.lossRevealsField:
+            merged = updated
+            break
+        if updated:
+            merged.extend(updated)
+        if game.state == 'lost':
+            break
+    game.updated = merged
+
+def sample_mines(sample, n, mineCount, excluded):
+    """
+    Pick mineCount of range(n) outside excluded. sample(n, k) must return
+    k distinct values of range(n) in random order; taking the first allowed
+    ones of k + len(excluded) keeps the pick uniform.
+    """
+    picked = [k for k in sample(n, mineCount + len(excluded)) if k not in excluded]
+    return picked[:mineCount]
+
 class MineSweep:
     """
     members:
 
     mines: a set of positions that has a mine.
     neigs: a dict of position to list. For example, neigsCounts[p] = [p1, p2, p3].
+        It is built by start().
     uncovered: a set of uncovered positions.
     positions: a set of valid positions.
+    labelRegions: if True, start() labels the connected zero regions, and
+        uncover() opens a whole region and its border at once.
+    regionOf: a dict of zero position to its region id (labelRegions only).
+    regions: a list of region id to the positions it opens (labelRegions only).
+    seed: the seed the mines were generated from, None if unknown.
+    firstClick: the position kept free of mines by gen_mines, or None.
+    lossRevealsField: a lost game updates every position, see uncover_many.
 
     methods:
     uncover(pos)
+    uncover_many(positions)
     start()
     get_updated()
     get_state()
     """
-    def __init__(self, size, mineCount):
+    lossRevealsField = True
+
+    def __init__(self, size, mineCount, labelRegions=False):
         self.size = w, h =size
         self.mineCount = mineCount
         if mineCount > w * h:
             raise Exception("field with size {}x{} can not hold {} mines".format(w, h, mineCount))
         self.state = 'not_start'
         self.positions = {(i, j) for i in range(self.size[0]) for j in range(self.size[1])}
-        self.neigs = {p:self.get_neigs(p) for p in self.positions}
+        self.neigs = None
         self.mines = None
+        self.seed = None
+        self.firstClick = None
+        self.labelRegions = labelRegions
 
-    def gen_mines(self):
-        mines = list(self.positions)
-        # shuffle(mines)
-        random.shuffle(mines)
-        self.mines = set(mines[:self.mineCount])
+    def gen_mines(self, seed=None, safe=None, strategy='sample'):
+        """
+        Place the mines. The same seed gives the same field; if it is None
+        one is drawn from the random module, it is kept in self.seed anyway.
+        If safe is a position, no mine is put on it or around it.
+        strategy is 'sample' (O(mineCount) sampling) or 'shuffle' (shuffle
+        the whole field).
+        """
+        if seed is None:
+            seed = random.getrandbits(63)
+        rng = random.Random(seed)
+        w, h = self.size
+        excluded = safe_zone(self.size, self.mineCount, safe)
+        if strategy == 'sample':
+            picked = sample_mines(lambda n, k: rng.sample(range(n), k), w * h, self.mineCount, excluded)
+        elif strategy == 'shuffle':
+            picked = [k for k in range(w * h) if k not in excluded]
+            rng.shuffle(picked)
+            picked = picked[:self.mineCount]
+        else:
+            raise ValueError("unknown strategy {!r}".format(strategy))
+        self.mines = {divmod(k, h) for k in picked}
+        self.seed = seed
+        self.firstClick = safe
 
     def start(self):
         """
@@ -47,13 +139,46 @@ class MineSweep:
         """
         assert self.mines
         positions = self.positions
+        if self.neigs is None:
+            self.neigs = {p:self.get_neigs(p) for p in positions}
         self.uncovered = set()
 
         self.neigMineCount = {}
         for p in positions:
             self.neigMineCount[p] = sum(1 for p1 in self.neigs[p] if p1 in self.mines)
+        if self.labelRegions:
+            self.label_regions()
         self.state = 'running'
 
+    def label_regions(self):
+        """
+        Label the connected zero regions. Each region keeps the zero
+        positions together with their border, which is what a click on any
+        of them opens.
+        """
+        counts = self.neigMineCount
+        self.regionOf = regionOf = {}
+        self.regions = regions = []
+        for p in self.positions:
+            if counts[p] != 0 or p in self.mines or p in regionOf:
+                continue
+            rid = len(regions)
+            region = [p]
+            regionOf[p] = rid
+            seen = {p}
+            k = 0
+            while k < len(region):
+                p0 = region[k]
+                k += 1
+                if counts[p0] != 0: continue
+                for p1 in self.neigs[p0]:
+                    if p1 in seen: continue
+                    seen.add(p1)
+                    region.append(p1)
+                    if counts[p1] == 0:
+                        regionOf[p1] = rid
+            regions.append(region)
+
     def get_neigs(self, pos):
         D = itertools.product(range(-1, 2), range(-1, 2))
         i, j = pos
@@ -86,20 +211,44 @@ class MineSweep:
             self.state = 'lost'
             return
 
-        stk = [pos]
-        self.uncovered.add(pos)
-        while stk:
-            p0 = stk.pop()
-            updated.append((p0, self.neigMineCount[p0]))
-            if self.neigMineCount[p0] == 0:
-                for p1 in self.neigs[p0]:
-                    if p1 not in self.uncovered and p1 not in self.mines:
-                        stk.append(p1)
-                        self.uncovered.add(p1)
+        if self.labelRegions:
+            self.uncover_region(pos)
+        else:
+            stk = [pos]
+            self.uncovered.add(pos)
+            while stk:
+                p0 = stk.pop()
+                updated.append((p0, self.neigMineCount[p0]))
+                if self.neigMineCount[p0] == 0:
+                    for p1 in self.neigs[p0]:
+                        if p1 not in self.uncovered and p1 not in self.mines:
+                            stk.append(p1)
+                            self.uncovered.add(p1)
 
         if len(self.uncovered) + len(self.mines) == len(self.positions):
             self.state = 'win'
 
+    def uncover_region(self, pos):
+        """
+        Open the labeled region of pos in one go.
+        """
+        rid = self.regionOf.get(pos)
+        if rid is None:
+            opened = [pos]
+        else:
+            opened = [p for p in self.regions[rid] if p not in self.uncovered]
+        self.uncovered.update(opened)
+        self.updated.extend((p, self.neigMineCount[p]) for p in opened)
+
+    def in_field(self, pos):
+        return pos in self.positions
+
+    def uncover_many(self, positions):
+        """
+        Uncover a batch of positions as one operation, see uncover_many.
+        """
+        uncover_many(self, positions)
+
     def get_updated(self):
         """
         Get last updated stuff. If success, return a list of updated (position
@@ -118,12 +267,28 @@ class MineSweep:
         """
         return self.state
 
+    def to_map(self):
+        """
+        Return the mine field in the mapfile format.
+        """
+        bitmap = mapfile.pack_positions(self.size, self.mines)
+        return mapfile.encode(self.size, self.mineCount, self.seed, bitmap, self.firstClick)
+
+    @staticmethod
+    def from_map(view):
+        """
+        Create a game from a mapfile.MapView.
+        """
+        game = MineSweep(view.size, view.mineCount)
+        game.seed = view.seed
+        game.firstClick = view.firstClick
+        game.mines = set(view.mine_positions())
+        return game
+
     def save(self, filename):
         with open(filename, 'wb') as outfile:
-            pickle.dump(self, outfile)
+            outfile.write(self.to_map())
 
     @staticmethod
     def load(filename):
-        with open(filename, 'rb') as infile:
-            data = pickle.load(infile)
-        return data
+        return MineSweep.from_map(mapfile.MapView.open(filename))
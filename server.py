@@ -0,0 +1,341 @@
+"""
+An asyncio game server hosting many MineSweep sessions, and an async client
+adapter so an AIClient can play remote games.
+
+Every message is a frame: a 4 byte big endian length, then that many bytes
+of JSON. A request has an "op", an optional "id" echoed in the reply (so
+requests can be pipelined), and the op's arguments:
+
+    new      size [w, h], mines, seed (optional), safe [i, j] (optional)
+             -> session, size, mines, firstClick
+             (at most MAX_CELLS positions for the engine, at least one
+             mine, seed a non-negative integer, safe inside the field)
+    uncover  session, positions [[i, j], ...]
+             -> state, updated [[i, j, x], ...] (one MineSweep.uncover_many)
+    state    session -> state
+    close    session
+
+Replies have "ok": true, or "ok": false and an "error". Sessions belong to
+the connection that made them and are dropped when it closes.
+
+    python3 server.py --port 8765          # serve on TCP
+    python3 server.py --unix /tmp/ms.sock  # serve on a unix socket
+    python3 server.py --demo 100           # play 100 AI games on localhost
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import struct
+import sys
+import time
+
+import ai
+import arraysweep
+import minesweep
+
+FRAME = struct.Struct('>I')
+MAX_FRAME = 1 << 24
+# the largest field a new request may ask for, per engine: a MineSweep
+#  keeps a few python objects per position and takes about a second to
+#  start 256x256, an ArrayMineSweep starts 2048x2048 in a fraction of that
+MAX_CELLS = {minesweep.MineSweep: 1 << 16, arraysweep.ArrayMineSweep: 1 << 22}
+MAX_SEED = 1 << 63
+# the AI moves of play_remote, one at a time off the event loop: the
+#  solver cache they share is not locked
+moveExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+# the new games, built and started off the event loop one at a time, so
+#  at most one big field is being built
+gameExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+class ProtocolError(Exception):
+    pass
+
+async def read_frame(reader):
+    """
+    Read one message, None at end of stream.
+    """
+    try:
+        header = await reader.readexactly(FRAME.size)
+    except asyncio.IncompleteReadError:
+        return None
+    length, = FRAME.unpack(header)
+    if length > MAX_FRAME:
+        raise ProtocolError("frame of {} bytes is too big".format(length))
+    try:
+        message = json.loads(await reader.readexactly(length))
+    except ValueError as err:
+        raise ProtocolError("bad frame: {}".format(err))
+    if not isinstance(message, dict):
+        raise ProtocolError("a frame must hold a JSON object")
+    return message
+
+def write_frame(writer, message):
+    data = json.dumps(message, separators=(',', ':')).encode()
+    writer.write(FRAME.pack(len(data)) + data)
+
+class GameServer:
+    """
+    members:
+
+    sessions: a dict of session id to running game.
+    engine: the game class, None (the default) for a minesweep.MineSweep up
+        to its MAX_CELLS and an arraysweep.ArrayMineSweep for a bigger field.
+    """
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.sessions = {}
+        self.nextId = itertools.count(1)
+
+    async def handle(self, reader, writer):
+        owned = set()
+        try:
+            while True:
+                request = await read_frame(reader)
+                if request is None:
+                    break
+                try:
+                    reply = await self.dispatch(request, owned)
+                    reply['ok'] = True
+                except Exception as err:
+                    # a bad request only fails itself, the connection stays up
+                    reply = {'ok': False, 'error': '{}: {}'.format(type(err).__name__, err)}
+                if 'id' in request:
+                    reply['id'] = request['id']
+                write_frame(writer, reply)
+                await writer.drain()
+        except (ConnectionError, ProtocolError):
+            pass
+        finally:
+            for session in owned:
+                self.sessions.pop(session, None)
+            writer.close()
+
+    async def dispatch(self, request, owned):
+        op = request.get('op')
+        if op == 'new':
+            return await self.new_game(request, owned)
+        session = request['session']
+        if session not in owned:
+            raise ProtocolError("unknown session {}".format(session))
+        game = self.sessions[session]
+        if op == 'uncover':
+            return self.uncover(game, request['positions'])
+        if op == 'state':
+            return {'state': game.get_state()}
+        if op == 'close':
+            owned.discard(session)
+            del self.sessions[session]
+            return {}
+        raise ProtocolError("unknown op {!r}".format(op))
+
+    def engine_for(self, cells):
+        """
+        The game class for a field of that many positions.
+        """
+        if self.engine is not None:
+            return self.engine
+        if cells <= MAX_CELLS[minesweep.MineSweep]:
+            return minesweep.MineSweep
+        return arraysweep.ArrayMineSweep
+
+    async def new_game(self, request, owned):
+        w, h = request['size']
+        mineCount = request['mines']
+        seed = request.get('seed')
+        safe = request.get('safe')
+        if not all(type(x) is int for x in (w, h, mineCount)):
+            raise ProtocolError("size and mines must be integers")
+        if not (0 < w and 0 < h):
+            raise ProtocolError("size must be positive")
+        engine = self.engine_for(w * h)
+        maxCells = MAX_CELLS.get(engine, MAX_CELLS[minesweep.MineSweep])
+        if w * h > maxCells:
+            raise ProtocolError("{}x{} is more than the {} positions of a {} field".format(
+                w, h, maxCells, engine.__name__))
+        # the first click needs a position without a mine
+        if not 0 < mineCount <= w * h - (safe is not None):
+            raise ProtocolError("a {}x{} field can not hold {} mines".format(w, h, mineCount))
+        if seed is not None and not (type(seed) is int and 0 <= seed < MAX_SEED):
+            raise ProtocolError("seed must be an integer in [0, 2**63)")
+        if safe is not None:
+            i, j = safe
+            if not (type(i) is int and type(j) is int and 0 <= i < w and 0 <= j < h):
+                raise ProtocolError("safe {} is outside the field".format(safe))
+            safe = i, j
+        def build():
+            game = engine((w, h), mineCount)
+            game.gen_mines(seed, safe)
+            game.start()
+            return game
+        # a big field takes a while, the other sessions go on meanwhile
+        game = await asyncio.get_running_loop().run_in_executor(gameExecutor, build)
+        session = next(self.nextId)
+        self.sessions[session] = game
+        owned.add(session)
+        return {'session': session, 'size': [w, h], 'mines': game.mineCount,
+                'firstClick': list(safe) if safe is not None else None}
+
+    def uncover(self, game, positions):
+        game.uncover_many([(i, j) for i, j in positions])
+        data = game.get_updated() or []
+        return {'state': game.get_state(), 'updated': [[p[0], p[1], x] for p, x in data]}
+
+class RemoteConnection:
+    """
+    An async client connection. Requests can be in flight from many tasks
+    at once, replies are matched by id.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}
+        self.nextId = itertools.count(1)
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    @classmethod
+    async def open(cls, host='127.0.0.1', port=8765):
+        return cls(*await asyncio.open_connection(host, port))
+
+    @classmethod
+    async def open_unix(cls, path):
+        return cls(*await asyncio.open_unix_connection(path))
+
+    async def receive(self):
+        try:
+            while True:
+                reply = await read_frame(self.reader)
+                if reply is None:
+                    break
+                future = self.pending.pop(reply.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("connection closed"))
+            self.pending.clear()
+
+    async def request(self, op, **args):
+        args['op'] = op
+        args['id'] = requestId = next(self.nextId)
+        future = self.pending[requestId] = asyncio.get_running_loop().create_future()
+        write_frame(self.writer, args)
+        await self.writer.drain()
+        reply = await future
+        if not reply['ok']:
+            raise ProtocolError(reply['error'])
+        return reply
+
+    async def new_game(self, size, mineCount, seed=None, safe=None):
+        reply = await self.request('new', size=list(size), mines=mineCount, seed=seed,
+                                   safe=list(safe) if safe is not None else None)
+        return RemoteGame(self, reply)
+
+    async def close(self):
+        self.writer.close()
+        await self.receiver
+
+class RemoteGame:
+    """
+    A remote session with the read side of the MineSweep interface
+    (size, mineCount, firstClick, get_state), so an AIClient can
+    be built on it. Moves are async, see uncover_many.
+    """
+    def __init__(self, connection, reply):
+        self.connection = connection
+        self.session = reply['session']
+        self.size = tuple(reply['size'])
+        self.mineCount = reply['mines']
+        self.firstClick = tuple(reply['firstClick']) if reply['firstClick'] else None
+        self.state = 'running'
+
+    def get_state(self):
+        return self.state
+
+    async def uncover_many(self, positions):
+        """
+        Uncover a batch of positions, return the merged (position, count)
+        updates.
+        """
+        reply = await self.connection.request(
+                'uncover', session=self.session, positions=[list(p) for p in positions])
+        self.state = reply['state']
+        return [((i, j), x) for i, j, x in reply['updated']]
+
+    async def close(self):
+        await self.connection.request('close', session=self.session)
+
+async def play_remote(game, player):
+    """
+    The async counterpart of Client.play: player (a Client, usually an
+    AIClient built on game) plays a RemoteGame until it ends. Its moves are
+    found on moveExecutor, so they do not hold up the event loop.
+    """
+    player.field = {}
+    loop = asyncio.get_running_loop()
+    while game.get_state() == player.STATE_RUNNING:
+        # a move may search for seconds, the other sessions go on meanwhile
+        commands = player.parse_input(await loop.run_in_executor(moveExecutor, player.get_input))
+        if commands is None:
+            continue
+        marks = [pos for opr, pos in commands if opr == player.OPR_MARK]
+        if marks:
+            player.mark_many(marks)
+        positions = [pos for opr, pos in commands if opr == player.OPR_UNCOVER]
+        if positions:
+            player.update(await game.uncover_many(positions))
+        # let the other sessions move
+        await asyncio.sleep(0)
+    return game.get_state()
+
+async def demo(games, size, mineCount, seed=0):
+    """
+    Serve on a localhost port and play games concurrently over it, each with
+    its own connection.
+    """
+    server = GameServer()
+    listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    async def one(k):
+        connection = await RemoteConnection.open('127.0.0.1', port)
+        try:
+            game = await connection.new_game(size, mineCount, seed + k,
+                                             (size[0] // 2, size[1] // 2))
+            state = await play_remote(game, ai.QuietAIClient(game))
+            await game.close()
+            return state
+        finally:
+            await connection.close()
+    start = time.perf_counter()
+    states = await asyncio.gather(*(one(k) for k in range(games)))
+    wallTime = time.perf_counter() - start
+    listener.close()
+    await listener.wait_closed()
+    return {'games': games, 'wins': states.count('win'), 'wall_s': wallTime,
+            'sessions_left': len(server.sessions)}
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="mine sweeper game server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='serve on this unix socket path instead')
+    parser.add_argument('--demo', type=int, metavar='N',
+                        help='play N AI games against a localhost server and exit')
+    args = parser.parse_args(argv)
+    if args.demo:
+        print(json.dumps(asyncio.run(demo(args.demo, (16, 30), 99)), indent=2))
+        return
+    async def serve():
+        server = GameServer()
+        if args.unix:
+            listener = await asyncio.start_unix_server(server.handle, args.unix)
+        else:
+            listener = await asyncio.start_server(server.handle, args.host, args.port)
+        async with listener:
+            await listener.serve_forever()
+    asyncio.run(serve())
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
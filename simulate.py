@@ -0,0 +1,182 @@
+"""
+Play many seeded AI games headless and report solver statistics as JSON.
+
+    python3 simulate.py -n 100 --size 16x30 --mines 99 -j 4
+    python3 simulate.py -n 10 --profile --trace moves.jsonl --pstats phases.prof
+
+Every game i is played with seed + i, so a run can be reproduced exactly.
+--profile turns on the solver counters (see instrument.py), --trace writes
+every move as JSON lines and --pstats the phase timings for pstats.
+--backend picks the solver search (see solver.use_backend) and
+--cross-check checks the C one against Python on every search.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ai
+import instrument
+import minesweep
+import solver
+
+PHASES = ('infer', 'search_safe_slot', 'advanced_infer', 'endgame', 'guess')
+COUNTERS = ('search', 'propagate', 'pivot', 'apply', 'undo', 'witness')
+# random: the first click may hit a mine, safe: the center and its
+#  neighbours have no mine, no-guess: the solver wins without guessing
+BOARDS = ('random', 'safe', 'no-guess')
+
+def play_one(args):
+    """
+    Play one game, return a dict of its result.
+    """
+    size, mineCount, seed, workers, board, profile, trace, budget, backend = args
+    solver.use_backend(*backend)
+    instrument.enable(profile)
+    instrument.reset()
+    random.seed(seed)
+    game = minesweep.MineSweep(size, mineCount)
+    center = size[0] // 2, size[1] // 2
+    if board == 'no-guess':
+        ai.gen_no_guess(game, center, seed * 1000)
+    else:
+        game.gen_mines(seed, center if board == 'safe' else None)
+    client = ai.QuietAIClient(game, workers)
+    client.recorder.sampleEvery = 1 if trace else 0
+    client.moveSeconds, client.moveNodes = budget
+    hits, misses = client.cache.hits, client.cache.misses
+    start = time.perf_counter()
+    client.play()
+    return {
+        'seed': seed,
+        'win': game.get_state() == 'win',
+        'guesses': client.guessCount,
+        'steps': client.step,
+        'budget_outs': client.budgetOuts,
+        'seconds': time.perf_counter() - start,
+        'latencies': {phase: [t / 1e9 for t in client.recorder.phases.get(phase, [])]
+                      for phase in PHASES},
+        'phase_ns': dict(client.recorder.phases),
+        'counters': dict(instrument.counters) if profile else None,
+        'moves': client.recorder.moves,
+        'cache_hits': client.cache.hits - hits,
+        'cache_misses': client.cache.misses - misses,
+        }
+
+def percentile(values, q):
+    """
+    Nearest rank percentile of a sorted list.
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+def summarize(results, wallTime):
+    n = len(results)
+    hits = sum(r['cache_hits'] for r in results)
+    misses = sum(r['cache_misses'] for r in results)
+    phases = {}
+    counters = None
+    if results and results[0]['counters'] is not None:
+        counters = {name: sum(r['counters'].get(name, 0) for r in results) for name in COUNTERS}
+        counters['max_depth'] = max(r['counters'].get('max_depth', 0) for r in results)
+    for phase in PHASES:
+        values = sorted(t for r in results for t in r['latencies'][phase])
+        phases[phase] = {
+            'calls': len(values),
+            'p50_ms': None if not values else percentile(values, 50) * 1000,
+            'p95_ms': None if not values else percentile(values, 95) * 1000,
+            'p99_ms': None if not values else percentile(values, 99) * 1000,
+            'total_s': sum(values),
+            }
+    return {
+        'games': n,
+        'wins': sum(r['win'] for r in results),
+        'win_rate': sum(r['win'] for r in results) / n if n else None,
+        'guesses_per_game': sum(r['guesses'] for r in results) / n if n else None,
+        'steps_per_game': sum(r['steps'] for r in results) / n if n else None,
+        'budget_outs': sum(r['budget_outs'] for r in results),
+        'wall_s': wallTime,
+        'games_per_s': n / wallTime if wallTime else None,
+        'phases': phases,
+        'cache': {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+            },
+        'counters': counters,
+        }
+
+def run(size, mineCount, games, seed=0, jobs=1, workers=0, board='random',
+        profile=False, trace=None, pstats=None, budget=(ai.MOVE_SECONDS, ai.MOVE_NODES),
+        backend=('auto', False)):
+    """
+    Play `games` games on a pool of `jobs` processes and summarize them.
+    workers is passed to each AIClient for its own solver pool. board is
+    one of BOARDS. If profile is set the solver counters are kept, trace
+    and pstats are file names to export the moves and phase timings to.
+    budget is the (seconds, nodes) search budget of a move, backend the
+    arguments of solver.use_backend.
+    """
+    tasks = [(size, mineCount, seed + i, workers, board, profile, bool(trace), budget, backend)
+             for i in range(games)]
+    start = time.perf_counter()
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(play_one, tasks, chunksize=max(1, games // (jobs * 4))))
+    else:
+        results = [play_one(task) for task in tasks]
+    summary = summarize(results, time.perf_counter() - start)
+    if trace:
+        with open(trace, 'w') as outfile:
+            for r in results:
+                for record in r['moves']:
+                    outfile.write(json.dumps(dict(record, seed=r['seed'])) + '\n')
+    if pstats:
+        phases = {phase: [t for r in results for t in r['phase_ns'].get(phase, [])]
+                  for phase in PHASES}
+        instrument.write_pstats(pstats, phases, {phase: getattr(ai.AIClient, phase)
+                                                 for phase in PHASES})
+    summary.update({'size': list(size), 'mines': mineCount, 'seed': seed,
+                    'jobs': jobs, 'workers': workers, 'board': board,
+                    'backend': solver.use_backend(*backend)})
+    return summary
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--games', type=int, default=100)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help='solver processes per game, default 0 (serial)')
+    parser.add_argument('--size', type=minesweep.parse_size, default=(16, 30), help='WxH, default 16x30')
+    parser.add_argument('--mines', type=int, default=99)
+    parser.add_argument('-b', '--board', choices=BOARDS, default='random')
+    parser.add_argument('-o', '--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--profile', action='store_true', help='keep the solver counters')
+    parser.add_argument('--trace', help='write every move to this JSON lines file')
+    parser.add_argument('--pstats', help='write the phase timings to this pstats file')
+    parser.add_argument('--move-seconds', type=float, default=ai.MOVE_SECONDS,
+                        help='search time budget of a move, default %(default)s')
+    parser.add_argument('--move-nodes', type=int, default=ai.MOVE_NODES,
+                        help='search node budget of a move, default no limit')
+    parser.add_argument('--backend', choices=('auto', 'c', 'python'), default='auto',
+                        help='solver search, default %(default)s (c if built)')
+    parser.add_argument('--cross-check', action='store_true',
+                        help='check every c search against the python one')
+    args = parser.parse_args(argv)
+    summary = run(args.size, args.mines, args.games, args.seed, args.jobs, args.workers,
+                  args.board, args.profile, args.trace, args.pstats,
+                  (args.move_seconds, args.move_nodes), (args.backend, args.cross_check))
+    text = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,661 @@
+"""
+A compact constraint solver for the mine sweeper frontier.
+
+A component indexes its slots as bit positions, and each uncovered node
+becomes a constraint (mask, count): exactly count of the slots in mask hold
+a mine. A partial assignment is a pair of masks (mines, safes), so
+propagation and backtracking are integer and/or and popcount operations.
+
+The search is iterative, and can be given a Budget of nodes and seconds;
+when it runs out the search raises BudgetExceeded.
+
+solve, first and count run in C when csolver.py finds its library built,
+see use_backend(); solutions and search are always Python. A big component
+is counted by a dynamic program instead, see sweep_count().
+"""
+import collections
+import itertools
+import time
+
+import instrument
+
+# the 8 rotations and reflections of the plane
+SYMMETRIES = [
+    lambda i, j: (i, j), lambda i, j: (i, -j), lambda i, j: (-i, j), lambda i, j: (-i, -j),
+    lambda i, j: (j, i), lambda i, j: (j, -i), lambda i, j: (-j, i), lambda i, j: (-j, -i),
+    ]
+
+# components up to this many slots are counted by going through their
+#  solutions, the bigger ones by sweep_count(), whose cost does not grow
+#  with the number of solutions
+ENUMERATE_MAX_SLOTS = 16
+# None until chosen by use_backend(), on the first search if not before
+BACKEND = None
+CROSS_CHECK = False
+csolver = None
+
+class BudgetExceeded(Exception):
+    pass
+
+class CrossCheckError(Exception):
+    pass
+
+def use_backend(name='auto', crossCheck=False):
+    """
+    Choose how Component.solve, first and count search: 'python', 'c' (an
+    error if csolver can not load its library) or 'auto', c if it can.
+    With crossCheck every C result is checked against the Python one, a
+    difference raises CrossCheckError. Return the backend chosen.
+    """
+    global BACKEND, CROSS_CHECK, csolver
+    if name == 'python':
+        BACKEND = 'python'
+    else:
+        import csolver
+        if csolver.load():
+            BACKEND = 'c'
+        elif name == 'c':
+            raise Exception("the c backend is not built: {}".format(csolver.loadError))
+        else:
+            BACKEND = 'python'
+    CROSS_CHECK = crossCheck
+    return BACKEND
+
+def accelerated():
+    """
+    Return the csolver module if the C backend is in use, else None.
+    """
+    if BACKEND is None:
+        use_backend()
+    return csolver if BACKEND == 'c' else None
+
+def cross_check(method, component, args, result, expected):
+    if result != expected:
+        raise CrossCheckError("{} of {} {}: c gives {!r}, python {!r}".format(
+            method, component, args, result, expected))
+
+class Budget:
+    """
+    A limit on the search work, usually of one move.
+    members:
+
+    nodes: how many more search nodes may be expanded, None for no limit.
+    deadline: the time.perf_counter() after which the search stops, None
+        for no limit.
+    exceeded: whether the budget ran out.
+    CLOCK_EVERY: nodes expanded between two reads of the clock.
+    """
+    CLOCK_EVERY = 64
+    def __init__(self, nodes=None, seconds=None):
+        self.nodes = nodes
+        self.deadline = None if seconds is None else time.perf_counter() + seconds
+        self.exceeded = False
+        self.ticks = 0
+
+    def spend(self):
+        """
+        Count one search node, raise BudgetExceeded if the budget is out.
+        """
+        if self.nodes is not None:
+            self.nodes -= 1
+            if self.nodes < 0:
+                self.fail()
+        if self.deadline is not None:
+            self.ticks += 1
+            if self.ticks % self.CLOCK_EVERY == 0 and time.perf_counter() > self.deadline:
+                self.fail()
+
+    def check(self):
+        """
+        Raise BudgetExceeded if the budget is out, reading the clock now.
+        """
+        if self.exceeded or self.deadline is not None and time.perf_counter() > self.deadline:
+            self.fail()
+
+    def remaining_seconds(self):
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.perf_counter())
+
+    def fail(self):
+        self.exceeded = True
+        raise BudgetExceeded()
+
+def popcount(x):
+    return x.bit_count()
+
+def bits(x):
+    """
+    Yield the indices of the set bits of x.
+    """
+    while x:
+        low = x & -x
+        yield low.bit_length() - 1
+        x ^= low
+
+class Component:
+    """
+    A set of constraints over some slots.
+    members:
+
+    keys: keys[i] is the key (a position) of the slot at bit i.
+    index: a dict of key to bit index.
+    constraints: a list of (mask, count).
+    watch: watch[i] is the list of constraint indices that contain bit i.
+    full: the mask of all slots.
+    flat: its csolver.FlatComponent, made on the first search in C.
+    """
+    def __init__(self, keys, constraints):
+        self.keys = list(keys)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.constraints = list(constraints)
+        self.full = (1 << len(self.keys)) - 1
+        self.watch = [[] for key in self.keys]
+        for k, (mask, count) in enumerate(self.constraints):
+            for i in bits(mask):
+                self.watch[i].append(k)
+        self.flat = None
+
+    def __repr__(self):
+        return 'Component(slots={}, constraints={})'.format(
+                len(self.keys), len(self.constraints))
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_constraints(cls, constraints):
+        """
+        Build a component from a list of (keys, count).
+        """
+        keys = sorted({key for slotKeys, count in constraints for key in slotKeys})
+        index = {key: i for i, key in enumerate(keys)}
+        return cls(keys, [(sum(1 << index[key] for key in slotKeys), count)
+                          for slotKeys, count in constraints])
+
+    def signature(self):
+        """
+        A hashable form of the component, the same for two components with
+        the same keys and constraints.
+        """
+        return tuple(self.keys), frozenset(self.constraints)
+
+    def mask_of(self, keys):
+        return sum(1 << self.index[key] for key in keys)
+
+    def keys_of(self, mask):
+        return [self.keys[i] for i in bits(mask)]
+
+    def propagate(self, mines, safes, changed=None):
+        """
+        Apply every value forced by a single constraint until nothing
+        changes. Only the constraints touching the changed bits are checked
+        (all of them if changed is None). Return the new (mines, safes), or
+        None if a constraint can not be met.
+        """
+        if instrument.ENABLED: instrument.counters['propagate'] += 1
+        constraints = self.constraints
+        if changed is None:
+            queue = list(range(len(constraints)))
+        else:
+            queue = list({k for i in bits(changed) for k in self.watch[i]})
+        queued = set(queue)
+        while queue:
+            k = queue.pop()
+            queued.discard(k)
+            mask, count = constraints[k]
+            need = count - popcount(mask & mines)
+            free = mask & ~(mines | safes)
+            freeCount = popcount(free)
+            if need < 0 or need > freeCount:
+                return None
+            if not free or 0 < need < freeCount:
+                continue
+            if need == 0:
+                safes |= free
+            else:
+                mines |= free
+            for i in bits(free):
+                for k1 in self.watch[i]:
+                    if k1 not in queued:
+                        queued.add(k1)
+                        queue.append(k1)
+        return mines, safes
+
+    def choose_bit(self, mines, safes):
+        """
+        Pick a free bit of the most constrained constraint, that is the one
+        with the fewest ways to place its remaining mines.
+        """
+        if instrument.ENABLED: instrument.counters['pivot'] += 1
+        best = bestVal = None
+        for mask, count in self.constraints:
+            free = mask & ~(mines | safes)
+            if not free: continue
+            freeCount = popcount(free)
+            need = count - popcount(mask & mines)
+            val = min(need, freeCount - need), freeCount
+            if bestVal is None or val < bestVal:
+                bestVal, best = val, free
+        return best & -best
+
+    def solutions(self, mines=0, safes=0, maxMines=None, budget=None):
+        """
+        Yield the mines mask of every solution that extends the assignment
+        and uses at most maxMines mines. Raise BudgetExceeded if budget (a
+        Budget) runs out first.
+        """
+        state = self.propagate(mines, safes)
+        if state is not None:
+            yield from self.search(state[0], state[1], maxMines, budget)
+
+    def search(self, mines, safes, maxMines, budget=None):
+        """
+        Depth first backtracking over a propagated assignment. The stack is
+        explicit, so no component is too deep for it. An entry is an
+        assignment, the bit just decided (to propagate, 0 for none) and how
+        many branchings led to it.
+        """
+        stack = [(mines, safes, 0, 0)]
+        while stack:
+            mines, safes, bit, depth = stack.pop()
+            if bit:
+                state = self.propagate(mines, safes, bit)
+                if state is None: continue
+                mines, safes = state
+            if budget is not None: budget.spend()
+            if instrument.ENABLED:
+                instrument.counters['search'] += 1
+                instrument.note_depth(depth)
+            if maxMines is not None and popcount(mines) > maxMines:
+                continue
+            if mines | safes == self.full:
+                yield mines
+                continue
+            bit = self.choose_bit(mines, safes)
+            # pushed in reverse, the mine branch is taken first
+            stack.append((mines, safes | bit, bit, depth + 1))
+            stack.append((mines | bit, safes, bit, depth + 1))
+
+    def solve(self, mines=0, safes=0, maxMines=None, budget=None):
+        """
+        Return the mines mask of one solution, or None if there is none.
+        """
+        fast = accelerated()
+        if fast is None:
+            return self.solve_python(mines, safes, maxMines, budget)
+        result = fast.solve(self, mines, safes, maxMines, budget)
+        if CROSS_CHECK:
+            cross_check('solve', self, (mines, safes, maxMines), result,
+                        self.solve_python(mines, safes, maxMines))
+        return result
+
+    def solve_python(self, mines=0, safes=0, maxMines=None, budget=None):
+        for solution in self.solutions(mines, safes, maxMines, budget):
+            return solution
+
+    def first(self, limit, mines=0, safes=0, maxMines=None, budget=None):
+        """
+        Return the list of the first limit solutions, in the order of
+        solutions().
+        """
+        fast = accelerated()
+        if fast is None:
+            return self.first_python(limit, mines, safes, maxMines, budget)
+        result = fast.first(self, limit, mines, safes, maxMines, budget)
+        if CROSS_CHECK:
+            cross_check('first', self, (limit, mines, safes, maxMines), result,
+                        self.first_python(limit, mines, safes, maxMines))
+        return result
+
+    def first_python(self, limit, mines=0, safes=0, maxMines=None, budget=None):
+        return list(itertools.islice(self.solutions(mines, safes, maxMines, budget), limit))
+
+    def count(self, mines=0, safes=0, maxMines=None, budget=None):
+        """
+        Count the solutions by how many mines they use. Return (counts,
+        bitCounts): counts[m] is how many solutions have m mines, and
+        bitCounts[m][i] how many of them have a mine at bit i. A component
+        of more than ENUMERATE_MAX_SLOTS slots is counted by count_sweep().
+        """
+        if len(self.keys) > ENUMERATE_MAX_SLOTS:
+            return self.count_sweep(mines, safes, maxMines, budget)
+        fast = accelerated()
+        if fast is None or not fast.can_count(self):
+            return self.count_python(mines, safes, maxMines, budget)
+        result = fast.count(self, mines, safes, maxMines, budget)
+        if CROSS_CHECK:
+            cross_check('count', self, (mines, safes, maxMines), result,
+                        self.count_python(mines, safes, maxMines))
+        return result
+
+    def count_sweep(self, mines=0, safes=0, maxMines=None, budget=None):
+        """
+        Count as count() does, without going through the solutions: see
+        sweep_count(), over the bits in the order of sweep_order().
+        """
+        order = sweep_order(self)
+        rank = [0] * len(order)
+        for c, b in enumerate(order):
+            rank[b] = c
+        remap = lambda mask: sum(1 << rank[b] for b in bits(mask))
+        counts, bitCounts = sweep_count(
+                len(order), [(remap(mask), count) for mask, count in self.constraints],
+                remap(mines), remap(safes), maxMines, budget)
+        for m, perRank in bitCounts.items():
+            bitCounts[m] = [perRank[rank[b]] for b in range(len(order))]
+        return counts, bitCounts
+
+    def count_python(self, mines=0, safes=0, maxMines=None, budget=None):
+        counts = {}
+        bitCounts = {}
+        for solution in self.solutions(mines, safes, maxMines, budget):
+            m = popcount(solution)
+            counts[m] = counts.get(m, 0) + 1
+            perBit = bitCounts.get(m)
+            if perBit is None:
+                perBit = bitCounts[m] = [0] * len(self.keys)
+            for i in bits(solution):
+                perBit[i] += 1
+        return counts, bitCounts
+
+def sweep_order(component):
+    """
+    Order the bits of component so that the ones sharing a constraint come
+    close together (reverse Cuthill-McKee): breadth first from a bit at the
+    far end, the neighbours with fewer neighbours first. A frontier is a
+    thin band of slots, in this order it is swept along its length.
+    """
+    n = len(component.keys)
+    neighbours = [0] * n
+    for mask, count in component.constraints:
+        for i in bits(mask):
+            neighbours[i] |= mask
+    for i in range(n):
+        neighbours[i] &= ~(1 << i)
+    degree = [popcount(x) for x in neighbours]
+
+    def breadth_first(start, seen):
+        order = [start]
+        seen |= 1 << start
+        k = 0
+        while k < len(order):
+            fresh = sorted(bits(neighbours[order[k]] & ~seen), key=degree.__getitem__)
+            for i in fresh:
+                seen |= 1 << i
+            order.extend(fresh)
+            k += 1
+        return order
+
+    order = []
+    done = 0
+    for i in range(n):
+        if done >> i & 1: continue
+        # the last bit reached from any bit is at the far end of its part
+        start = breadth_first(breadth_first(i, done)[-1], done)[-1]
+        part = breadth_first(start, done)
+        for b in part:
+            done |= 1 << b
+        order.extend(reversed(part))
+    return order
+
+def sweep_count(n, constraints, mines=0, safes=0, maxMines=None, budget=None):
+    """
+    Count the solutions of the (mask, count) constraints over n bits, as
+    Component.count() does, by a dynamic program over the bits in order.
+    After the first b bits are decided, its state is how many mines each
+    constraint with bits on both sides of b holds so far; when few are
+    open at a time the states stay few, however many the solutions are. A
+    forward pass counts the ways to reach each state by mine total, a
+    backward pass the ways to finish from it, and the solutions with a
+    mine at bit b join the two across b. The budget is spent once per
+    state of the forward pass.
+    """
+    if any(count < 0 or count > popcount(mask) for mask, count in constraints):
+        return {}, {}
+    firsts = [(mask & -mask).bit_length() - 1 for mask, count in constraints]
+    lasts = [mask.bit_length() - 1 for mask, count in constraints]
+    watch = [[] for b in range(n)]
+    for k, (mask, count) in enumerate(constraints):
+        for b in bits(mask):
+            watch[b].append(k)
+    # opens[b]: the constraints open once the first b bits are decided
+    opens = [[] for b in range(n + 1)]
+    for k in range(len(constraints)):
+        for b in range(firsts[k] + 1, lasts[k] + 1):
+            opens[b].append(k)
+
+    def step(b, state, val):
+        placed = dict(zip(opens[b], state))
+        for k in watch[b]:
+            mask, count = constraints[k]
+            p = placed.get(k, 0) + val
+            if p > count or p + popcount(mask >> (b + 1)) < count:
+                return None
+            placed[k] = p
+        return tuple(placed[k] for k in opens[b + 1])
+
+    # forward: layers[b] maps a state to its ways by mine total
+    layers = [{(): {0: 1}}]
+    edges = []
+    for b in range(n):
+        vals = (1,) if mines >> b & 1 else (0,) if safes >> b & 1 else (0, 1)
+        layer = {}
+        edge = []
+        for state, ways in layers[b].items():
+            if budget is not None: budget.spend()
+            for val in vals:
+                next = step(b, state, val)
+                if next is None: continue
+                edge.append((state, val, next))
+                target = layer.setdefault(next, {})
+                for m, c in ways.items():
+                    if maxMines is not None and m + val > maxMines: continue
+                    target[m + val] = target.get(m + val, 0) + c
+        layers.append(layer)
+        edges.append(edge)
+    # backward: tails maps a state to its ways to finish by mine total
+    tails = {(): {0: 1}}
+    perBit = {}
+    for b in range(n - 1, -1, -1):
+        heads = {}
+        for state, val, next in edges[b]:
+            tail = tails.get(next)
+            if not tail: continue
+            head = heads.setdefault(state, {})
+            for m, c in tail.items():
+                head[m + val] = head.get(m + val, 0) + c
+            if val:
+                for m1, c1 in layers[b][state].items():
+                    for m2, c2 in tail.items():
+                        m = m1 + 1 + m2
+                        if maxMines is not None and m > maxMines: continue
+                        bitWays = perBit.setdefault(m, {})
+                        bitWays[b] = bitWays.get(b, 0) + c1 * c2
+        tails = heads
+    counts = {m: c for m, c in tails.get((), {}).items()
+              if c and (maxMines is None or m <= maxMines)}
+    bitCounts = {}
+    for m in counts:
+        bitWays = perBit.get(m, {})
+        bitCounts[m] = [bitWays.get(b, 0) for b in range(n)]
+    return counts, bitCounts
+
+def canonical(component):
+    """
+    Return (key, order) for a component whose keys are positions. key is
+    the same for every rotation, reflection and translation of the
+    component, and order[c] is the bit index of the component that comes
+    c-th in the canonical form.
+    """
+    best = None
+    n = len(component.keys)
+    for transform in SYMMETRIES:
+        points = [transform(*key) for key in component.keys]
+        mi = min(i for i, j in points)
+        mj = min(j for i, j in points)
+        points = [(i - mi, j - mj) for i, j in points]
+        order = sorted(range(n), key=points.__getitem__)
+        rank = [0] * n
+        for c, b in enumerate(order):
+            rank[b] = c
+        constraints = sorted((sum(1 << rank[b] for b in bits(mask)), count)
+                             for mask, count in component.constraints)
+        key = tuple(points[b] for b in order), tuple(constraints)
+        if best is None or key < best[0]:
+            best = key, order
+    return best
+
+class ComponentCache:
+    """
+    A bounded LRU cache of Component.count() results, keyed by the
+    canonical form of the component, so a frontier shape seen before (in
+    any orientation) is not solved again.
+    members:
+
+    maxSize: how many components are kept.
+    entries: an OrderedDict of canonical key to counts in canonical order.
+    hits, misses
+    """
+    def __init__(self, maxSize=4096):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, component, budget=None):
+        """
+        Same as component.count(), through the cache. A count cut short by
+        the budget is not kept.
+        """
+        if not component.keys:
+            return component.count()
+        key, order = canonical(component)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            counts, canonBitCounts = entry
+        else:
+            self.misses += 1
+            counts, bitCounts = component.count(budget=budget)
+            canonBitCounts = {m: [perBit[b] for b in order] for m, perBit in bitCounts.items()}
+            self.entries[key] = counts, canonBitCounts
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        bitCounts = {}
+        for m, canonPerBit in canonBitCounts.items():
+            perBit = bitCounts[m] = [0] * len(order)
+            for c, b in enumerate(order):
+                perBit[b] = canonPerBit[c]
+        return dict(counts), bitCounts
+
+    def forced(self, component, maxMines=None, budget=None):
+        """
+        Return (safes, mines): masks of the bits that are safe (or mines) in
+        every solution using at most maxMines mines.
+        """
+        counts, bitCounts = self.count(component, budget)
+        total = 0
+        perBit = [0] * len(component.keys)
+        for m, c in counts.items():
+            if maxMines is not None and m > maxMines: continue
+            total += c
+            for i, x in enumerate(bitCounts[m]):
+                perBit[i] += x
+        safes = mines = 0
+        if total == 0:
+            return safes, mines
+        for i, x in enumerate(perBit):
+            if x == 0:
+                safes |= 1 << i
+            elif x == total:
+                mines |= 1 << i
+        return safes, mines
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.entries),
+            'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+def encode(component):
+    """
+    A compact picklable form of a component for worker processes: the slot
+    count and the constraints, without keys.
+    """
+    return len(component.keys), component.constraints
+
+def forced_bits(encoded, indices, val, maxMines=None, nodes=None, seconds=None):
+    """
+    Check which bit indices (of the given ones) can not take val in any
+    solution of an encoded component. This is the unit of work sent to a
+    process pool. A solution found for one bit is reused for the others it
+    gives val. nodes and seconds make its Budget. Return (forced, unchecked,
+    spent): unchecked are the bits left when the budget ran out, spent the
+    nodes searched (0 without a nodes limit).
+    """
+    n, constraints = encoded
+    component = Component(range(n), constraints)
+    budget = Budget(nodes, seconds)
+    forced = []
+    unchecked = []
+    # the bits a solution found so far gives val, no need to search them
+    able = 0
+    for k, i in enumerate(indices):
+        if able >> i & 1:
+            continue
+        try:
+            if val:
+                solution = component.solve(mines=1 << i, maxMines=maxMines, budget=budget)
+            else:
+                solution = component.solve(safes=1 << i, maxMines=maxMines, budget=budget)
+        except BudgetExceeded:
+            unchecked = [i1 for i1 in indices[k:] if not able >> i1 & 1]
+            break
+        if solution is None:
+            forced.append(i)
+        else:
+            able |= solution if val else component.full & ~solution
+    spent = 0 if nodes is None else nodes - max(budget.nodes, 0)
+    return forced, unchecked, spent
+
+def split(constraints):
+    """
+    Split a list of (keys, count) constraints into components that share no
+    key. Return a list of Component.
+    """
+    parent = {}
+    def find(key):
+        root = key
+        while parent[root] != root:
+            root = parent[root]
+        while parent[key] != root:
+            parent[key], key = root, parent[key]
+        return root
+    for slotKeys, count in constraints:
+        first = None
+        for key in slotKeys:
+            parent.setdefault(key, key)
+            if first is None:
+                first = find(key)
+            else:
+                root = find(key)
+                if root != first:
+                    parent[root] = first
+    groups = {}
+    empty = []
+    for constraint in constraints:
+        slotKeys = constraint[0]
+        if not slotKeys:
+            empty.append(constraint)
+            continue
+        groups.setdefault(find(next(iter(slotKeys))), []).append(constraint)
+    components = [Component.from_constraints(group) for group in groups.values()]
+    # a constraint without slots is a component on its own, it only has a
+    #  solution if its count is 0
+    components.extend(Component.from_constraints([constraint]) for constraint in empty)
+    return components